@@ -0,0 +1,127 @@
+"""
+Versione asincrona di app.storage.
+
+Le funzioni di storage sono sincrone (sqlite3): chiamarle direttamente da un
+handler blocca l'event loop di PTB. Qui ogni operazione viene eseguita su un
+pool di thread dedicato al DB, con una coda limitata: oltre `queue_size`
+richieste in volo i chiamanti attendono (senza bloccare il loop).
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from app import storage
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 256
+
+
+class DBExecutor:
+    def __init__(self, workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+        self._queue_size = queue_size
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.pending = 0  # richieste in volo o in attesa di uno slot
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._queue_size)
+        self.pending += 1
+        try:
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+_executor: Optional[DBExecutor] = None
+
+
+def configure(workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE):
+    """Crea (o ricrea) il pool DB. Da chiamare all'avvio, prima di qualsiasi query."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+    _executor = DBExecutor(workers, queue_size)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    storage.close_all()
+
+
+def pending() -> int:
+    """Richieste DB in volo o in coda sul pool."""
+    return _executor.pending if _executor is not None else 0
+
+
+async def run(fn: Callable, *args, **kwargs) -> Any:
+    """Esegue una funzione sincrona qualsiasi sul pool DB."""
+    if _executor is None:
+        configure()
+    return await _executor.run(fn, *args, **kwargs)
+
+
+def _wrap(fn: Callable) -> Callable:
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run(fn, *args, **kwargs)
+    return wrapper
+
+
+init_db = _wrap(storage.init_db)
+
+# Users
+delete_user = _wrap(storage.delete_user)
+get_user_data_version = _wrap(storage.get_user_data_version)
+get_user_chat_id = _wrap(storage.get_user_chat_id)
+get_vehicle_chat_id = _wrap(storage.get_vehicle_chat_id)
+
+# Vehicles
+add_vehicle = _wrap(storage.add_vehicle)
+list_vehicles = _wrap(storage.list_vehicles)
+get_vehicle = _wrap(storage.get_vehicle)
+update_vehicle_km = _wrap(storage.update_vehicle_km)
+delete_vehicle = _wrap(storage.delete_vehicle)
+
+# Maintenance
+add_maintenance = _wrap(storage.add_maintenance)
+list_maintenance = _wrap(storage.list_maintenance)
+get_user_summary = _wrap(storage.get_user_summary)
+rebuild_summaries = _wrap(storage.rebuild_summaries)
+search_maintenance = _wrap(storage.search_maintenance)
+list_types = _wrap(storage.list_types)
+add_type = _wrap(storage.add_type)
+delete_type = _wrap(storage.delete_type)
+
+# Reminders
+add_time_reminder = _wrap(storage.add_time_reminder)
+add_km_reminder = _wrap(storage.add_km_reminder)
+list_active_time_reminders = _wrap(storage.list_active_time_reminders)
+list_active_time_reminders_batch = _wrap(storage.list_active_time_reminders_batch)
+list_time_reminders_window = _wrap(storage.list_time_reminders_window)
+filter_active_reminders = _wrap(storage.filter_active_reminders)
+get_max_reminder_id = _wrap(storage.get_max_reminder_id)
+list_active_km_reminders = _wrap(storage.list_active_km_reminders)
+list_crossed_km_reminders = _wrap(storage.list_crossed_km_reminders)
+deactivate_reminder = _wrap(storage.deactivate_reminder)
+
+# Exports
+fetch_user_export = _wrap(storage.fetch_user_export)
+
+# Lease fra processi
+acquire_lease = _wrap(storage.acquire_lease)
+release_lease = _wrap(storage.release_lease)
+
+# Persistenza PTB
+load_persistence = _wrap(storage.load_persistence)
+load_persistence_kind = _wrap(storage.load_persistence_kind)
+save_persistence = _wrap(storage.save_persistence)
@@ -0,0 +1,248 @@
+"""
+Più processi del bot sulla stessa macchina, in modalità webhook.
+
+    BOT_MODE=webhook WEBHOOK_URL=... WEBHOOK_SECRET=... python -m app.cluster
+
+Il router ascolta su WEBHOOK_LISTEN:WEBHOOK_PORT al posto del bot, controlla il
+secret e inoltra ogni update al worker scelto dal chat_id: gli update di una
+chat arrivano sempre allo stesso processo, in ordine, e lo stato delle
+conversazioni resta in un solo posto. I WORKERS processi `app.main` ascoltano su
+127.0.0.1, porte WORKER_BASE_PORT+i; il supervisore li riavvia se escono.
+
+Il webhook lo registra solo il router, una volta, quando tutti i worker sono in
+ascolto (con i retry che Telegram chiede in caso di 429). I worker partono senza
+WEBHOOK_URL e non usano run_webhook, che chiamerebbe setWebhook a ogni avvio e
+riavvio (e senza URL ne registrerebbe uno generato da listen/porta): girano con
+run_worker, un piccolo server che mette in coda a PTB gli update del router.
+
+Promemoria e controllo km non dipendono dal routing: li pianifica un solo
+processo alla volta, quello che tiene il lease (app/leader.py).
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from telegram import Update
+from tornado import httpclient, ioloop, web
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+RESTART_DELAY = 2.0
+FORWARD_TIMEOUT = 30.0
+DEFAULT_API_URL = "https://api.telegram.org/bot"
+REGISTER_MAX_DELAY = 60.0
+
+
+def update_chat_id(update: Dict[str, Any]) -> int:
+    """chat_id (o id utente, per gli update senza chat) a cui si riferisce l'update; 0 se assente."""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat") or value.get("from") or value.get("user")
+        if chat and "id" in chat:
+            return int(chat["id"])
+    return 0
+
+
+def worker_for(chat_id: int, workers: int) -> int:
+    return chat_id % workers
+
+
+class Worker:
+    def __init__(self, index: int, port: int):
+        self.index = index
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}/{config.webhook_path}"
+        self.proc: Optional[subprocess.Popen] = None
+        self.restart_at = 0.0
+
+    def start(self):
+        # senza WEBHOOK_URL: il webhook pubblico lo registra il router, non i worker
+        env = {**os.environ, "BOT_MODE": "webhook", "WEBHOOK_LISTEN": "127.0.0.1", "WEBHOOK_URL": "",
+               "WEBHOOK_PORT": str(self.port), "WORKER_ID": str(self.index)}
+        if config.metrics_port:
+            # una porta metriche per worker: METRICS_PORT+i
+            env["METRICS_PORT"] = str(config.metrics_port + self.index)
+        self.proc = subprocess.Popen([sys.executable, "-m", "app.main"], env=env)
+        logger.info("Worker %d avviato (pid %d, porta %d)", self.index, self.proc.pid, self.port)
+
+
+class RouterHandler(web.RequestHandler):
+    def initialize(self, workers: List[Worker], client: httpclient.AsyncHTTPClient):
+        self.workers = workers
+        self.client = client
+
+    async def post(self):
+        if not hmac.compare_digest(self.request.headers.get(SECRET_HEADER, ""), config.webhook_secret):
+            self.set_status(403)
+            return
+        try:
+            update = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        worker = self.workers[worker_for(update_chat_id(update), len(self.workers))]
+        response = await self.client.fetch(
+            worker.url, method="POST", body=self.request.body, raise_error=False, request_timeout=FORWARD_TIMEOUT,
+            headers={"Content-Type": "application/json", SECRET_HEADER: config.webhook_secret},
+        )
+        # worker giù o in riavvio: 503, Telegram ritenterà la consegna più tardi
+        self.set_status(response.code if response.code < 599 else 503)
+
+
+async def _listening(port: int) -> bool:
+    try:
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        return False
+    writer.close()
+    return True
+
+
+async def register_webhook(workers: List[Worker], client: httpclient.AsyncHTTPClient):
+    """setWebhook una sola volta, appena tutti i worker accettano connessioni."""
+    for w in workers:
+        while not await _listening(w.port):
+            await asyncio.sleep(0.2)
+    url = f"{config.bot_api_url or DEFAULT_API_URL}{config.bot_token}/setWebhook"
+    body = json.dumps({"url": config.webhook_url, "secret_token": config.webhook_secret})
+    delay = 1.0
+    while True:
+        response = await client.fetch(url, method="POST", body=body, raise_error=False, request_timeout=FORWARD_TIMEOUT,
+                                      headers={"Content-Type": "application/json"})
+        try:
+            payload = json.loads(response.body or b"{}")
+        except ValueError:
+            payload = {}
+        if payload.get("ok"):
+            logger.info("Webhook registrato su %s", config.webhook_url)
+            return
+        # 429: aspetta quanto chiede Telegram; altri errori: backoff fino a REGISTER_MAX_DELAY
+        retry_after = (payload.get("parameters") or {}).get("retry_after")
+        wait = float(retry_after) if retry_after else delay
+        logger.warning("setWebhook fallito (%s %s), nuovo tentativo tra %.0fs",
+                       response.code, payload.get("description", ""), wait)
+        await asyncio.sleep(wait)
+        delay = min(delay * 2, REGISTER_MAX_DELAY)
+
+
+class WorkerUpdateHandler(web.RequestHandler):
+    """Lato worker: riceve dal router gli update e li mette nella coda di PTB."""
+
+    def initialize(self, app):
+        self.app = app
+
+    async def post(self):
+        if not hmac.compare_digest(self.request.headers.get(SECRET_HEADER, ""), config.webhook_secret):
+            self.set_status(403)
+            return
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            return
+        await self.app.update_queue.put(Update.de_json(data, self.app.bot))
+
+
+async def _run_worker(app):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    # stesso ciclo di vita di run_webhook, senza bootstrap del webhook
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    server = web.Application([(rf"/{config.webhook_path}/?", WorkerUpdateHandler, {"app": app})]).listen(
+        config.webhook_port, address=config.webhook_listen)
+    try:
+        await stop.wait()
+    finally:
+        server.stop()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def run_worker(app):
+    """Esegue l'application come worker del cluster (WORKER_ID impostato)."""
+    asyncio.run(_run_worker(app))
+
+
+class Supervisor:
+    def __init__(self, workers: int, base_port: int):
+        self.workers = [Worker(i, base_port + i) for i in range(workers)]
+        self.stopping = False
+
+    def check(self):
+        now = time.monotonic()
+        for w in self.workers:
+            code = w.proc.poll() if w.proc else None
+            if code is None or self.stopping:
+                continue
+            if not w.restart_at:
+                logger.warning("Worker %d uscito con codice %s, riavvio tra %.0fs", w.index, code, RESTART_DELAY)
+                w.restart_at = now + RESTART_DELAY
+            elif now >= w.restart_at:
+                w.restart_at = 0.0
+                w.start()
+
+    def stop(self):
+        self.stopping = True
+        # SIGINT: ogni worker chiude PTB in modo pulito e rilascia il lease se lo tiene
+        for w in self.workers:
+            if w.proc and w.proc.poll() is None:
+                w.proc.send_signal(signal.SIGINT)
+        for w in self.workers:
+            if w.proc:
+                try:
+                    w.proc.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    w.proc.kill()
+
+
+def main():
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    if config.mode != "webhook":
+        raise SystemExit("app.cluster richiede BOT_MODE=webhook (con WEBHOOK_URL e WEBHOOK_SECRET)")
+    n = config.workers or os.cpu_count() or 1
+    supervisor = Supervisor(n, config.worker_base_port or config.webhook_port + 1)
+    for w in supervisor.workers:
+        w.start()
+
+    client = httpclient.AsyncHTTPClient(max_clients=max(10, n * 16))
+    app = web.Application([(rf"/{config.webhook_path}/?", RouterHandler,
+                            {"workers": supervisor.workers, "client": client})])
+    app.listen(config.webhook_port, address=config.webhook_listen)
+    loop = ioloop.IOLoop.current()
+    ioloop.PeriodicCallback(supervisor.check, 500).start()
+    loop.spawn_callback(register_webhook, supervisor.workers, client)
+
+    def on_signal(*_):
+        loop.add_callback_from_signal(loop.stop)
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    print(f"Router su {config.webhook_listen}:{config.webhook_port}/{config.webhook_path} → {n} worker")
+    try:
+        loop.start()
+    finally:
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,60 @@ class Config:
     bot_token: str = os.getenv("BOT_TOKEN", "")
     db_path: str = os.getenv("DB_PATH", "./data/bot.db")
     tz: str = os.getenv("TZ", "Europe/Rome")
+    # Pool di thread per le query SQLite e limite di richieste in coda
+    db_workers: int = int(os.getenv("DB_WORKERS", "4"))
+    db_queue_size: int = int(os.getenv("DB_QUEUE_SIZE", "256"))
+    # Ogni quanti secondi salvare su DB lo stato delle conversazioni (user/chat data)
+    persistence_interval: float = float(os.getenv("PERSISTENCE_INTERVAL", "60"))
+    # Export costruiti in parallelo al massimo
+    export_workers: int = int(os.getenv("EXPORT_WORKERS", "2"))
+    # Endpoint Bot API alternativo (es. fake server locale per i test), vuoto = Telegram
+    bot_api_url: str = os.getenv("BOT_API_URL", "")
+    # Invio notifiche promemoria: worker, messaggi/s globali e per chat, tentativi
+    notify_workers: int = int(os.getenv("NOTIFY_WORKERS", "4"))
+    notify_rate: float = float(os.getenv("NOTIFY_RATE", "25"))
+    notify_chat_rate: float = float(os.getenv("NOTIFY_CHAT_RATE", "1"))
+    notify_max_retries: int = int(os.getenv("NOTIFY_MAX_RETRIES", "5"))
+    # Ricezione degli update: "polling" (getUpdates) oppure "webhook" (server HTTP integrato)
+    mode: str = os.getenv("BOT_MODE", "polling")
+    # Webhook: indirizzo e porta di ascolto, path, URL pubblico registrato su Telegram
+    # (quello del load balancer) e secret token controllato a ogni richiesta
+    webhook_listen: str = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    webhook_port: int = int(os.getenv("WEBHOOK_PORT", "8443"))
+    webhook_path: str = os.getenv("WEBHOOK_PATH", "telegram")
+    webhook_url: str = os.getenv("WEBHOOK_URL", "")
+    webhook_secret: str = os.getenv("WEBHOOK_SECRET", "")
+    # Update elaborati in parallelo (1 = uno alla volta, in ordine di arrivo)
+    concurrent_updates: int = int(os.getenv("CONCURRENT_UPDATES", "1"))
+    # Più processi (python -m app.cluster): quanti worker (0 = uno per core) e porta
+    # del primo worker dietro al router (0 = WEBHOOK_PORT + 1)
+    workers: int = int(os.getenv("WORKERS", "0"))
+    worker_base_port: int = int(os.getenv("WORKER_BASE_PORT", "0"))
+    # Indice del worker, impostato da app.cluster (-1 = processo singolo). I worker non
+    # registrano il webhook: lo fa il router, una volta sola
+    worker_id: int = int(os.getenv("WORKER_ID", "-1"))
+    # Lease del processo che pianifica i promemoria: durata senza rinnovo prima del
+    # failover, e ogni quanti secondi il leader raccoglie i promemoria creati dagli altri
+    lease_ttl: float = float(os.getenv("LEASE_TTL", "30"))
+    reminder_pickup_interval: float = float(os.getenv("REMINDER_PICKUP_INTERVAL", "30"))
+    # Promemoria tenuti in memoria dallo scheduler: quelli in scadenza entro tanti secondi
+    reminder_horizon: float = float(os.getenv("REMINDER_HORIZON", "3600"))
+    # Metriche Prometheus su http://METRICS_LISTEN:METRICS_PORT/metrics (0 = disattivate)
+    metrics_port: int = int(os.getenv("METRICS_PORT", "0"))
+    metrics_listen: str = os.getenv("METRICS_LISTEN", "127.0.0.1")
+    # Statement SQL più lenti di così (ms) finiscono nel log con il loro EXPLAIN (0 = spento)
+    slow_query_ms: float = float(os.getenv("SLOW_QUERY_MS", "0"))
+    # Profilazione: frazione di update profilati (0 = spenta), solo PROFILE_CHAT_ID se diverso da 0
+    profile_sample: float = float(os.getenv("PROFILE_SAMPLE", "0"))
+    profile_chat_id: int = int(os.getenv("PROFILE_CHAT_ID", "0"))
+    profile_dir: str = os.getenv("PROFILE_DIR", "./data/profiles")
+    # Chat che possono usare /admin_stats e /admin_profile, separate da virgola
+    admin_chat_ids: tuple = tuple(int(x) for x in os.getenv("ADMIN_CHAT_IDS", "").split(",") if x.strip())
 
 config = Config()
 if not config.bot_token:
     raise RuntimeError("BOT_TOKEN mancante. Impostalo in .env")
+if config.mode not in ("polling", "webhook"):
+    raise RuntimeError(f"BOT_MODE non valido: {config.mode!r} (polling o webhook)")
+if config.mode == "webhook" and not ((config.webhook_url or config.worker_id >= 0) and config.webhook_secret):
+    raise RuntimeError("In modalità webhook servono WEBHOOK_URL e WEBHOOK_SECRET. Impostali in .env")
@@ -0,0 +1,98 @@
+"""
+Costruzione dell'archivio di export (CSV + Excel) di un utente.
+
+Le righe arrivano dal DB a blocchi (storage.iter_user_export) e vengono scritte
+direttamente nelle voci dello zip, senza liste intermedie. L'archivio sta in
+memoria finché è piccolo e passa su file temporaneo oltre SPOOL_THRESHOLD.
+
+build_export è sincrona: va eseguita fuori dall'event loop, in un unico thread.
+"""
+import csv
+import io
+import time
+import zipfile
+from datetime import date, datetime
+
+from app import storage
+from app.utils.spool import SpooledBuffer
+
+SPOOL_THRESHOLD = 8 * 1024 * 1024  # oltre 8 MB l'archivio finisce su disco
+
+VEHICLE_FIELDS = ["id", "alias", "plate", "brand", "model", "year", "notes", "km_current", "created_at", "user_id"]
+MAINTENANCE_FIELDS = ["id", "vehicle_id", "date", "km", "type", "notes", "cost", "created_at", "alias"]
+REMINDER_FIELDS = ["id", "vehicle_id", "kind", "due_at", "km_threshold", "description", "active", "created_at", "alias"]
+
+SECTIONS = [
+    ("vehicles", VEHICLE_FIELDS),
+    ("maintenance", MAINTENANCE_FIELDS),
+    ("reminders", REMINDER_FIELDS),
+]
+
+
+def _write_csv(zf: zipfile.ZipFile, name: str, fields, rows):
+    with zf.open(name, mode="w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow([row[k] for k in fields])
+
+
+def _to_date(v):
+    try:
+        return date.fromisoformat(v)
+    except (TypeError, ValueError):
+        return v
+
+
+def _to_datetime(v):
+    try:
+        return datetime.fromisoformat(v)
+    except (TypeError, ValueError):
+        return v
+
+
+# conversioni per colonna: in Excel date e orari diventano celle data, non testo
+XLSX_CONVERTERS = {"date": _to_date, "due_at": _to_datetime, "created_at": _to_datetime}
+XLSX_NUMBER_FORMATS = {"cost": "#,##0.00", "km": "#,##0", "km_current": "#,##0", "km_threshold": "#,##0"}
+
+
+def _write_xlsx(zf: zipfile.ZipFile, db_path: str, chat_id: int):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+
+    # write-only: le righe vanno su file temporanei di openpyxl, non restano in memoria
+    wb = Workbook(write_only=True)
+    for section, fields in SECTIONS:
+        ws = wb.create_sheet(section)
+        ws.append(fields)
+        for row in storage.iter_user_export(db_path, chat_id, section):
+            values = []
+            for k in fields:
+                v = row[k]
+                if k in XLSX_CONVERTERS:
+                    v = XLSX_CONVERTERS[k](v)
+                elif k in XLSX_NUMBER_FORMATS and v is not None:
+                    v = WriteOnlyCell(ws, value=v)
+                    v.number_format = XLSX_NUMBER_FORMATS[k]
+                values.append(v)
+            ws.append(values)
+    # l'xlsx è già compresso: nello zip va memorizzato così com'è
+    info = zipfile.ZipInfo("export.xlsx", date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    with zf.open(info, mode="w") as f:
+        wb.save(f)
+
+
+def build_export(db_path: str, chat_id: int, spool_threshold: int = SPOOL_THRESHOLD):
+    """Ritorna un file temporaneo (riavvolto) con export.zip. Chi lo riceve deve chiuderlo."""
+    out = SpooledBuffer(max_size=spool_threshold, suffix=".zip")
+    try:
+        with zipfile.ZipFile(out, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for section, fields in SECTIONS:
+                _write_csv(zf, f"{section}.csv", fields, storage.iter_user_export(db_path, chat_id, section))
+            _write_xlsx(zf, db_path, chat_id)
+    except BaseException:
+        out.close()
+        raise
+    out.seek(0)
+    return out
@@ -0,0 +1,46 @@
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler, filters
+from app import metrics, profiling
+
+PROFILE_USAGE = ("Uso: /admin_profile [on [frazione] [chat_id] | off | dump | reset]\n"
+                 "es. /admin_profile on 0.1, /admin_profile on 1 123456789")
+
+async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(metrics.summary_text())
+
+async def admin_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args or []
+    action = args[0].lower() if args else ""
+    if action == "on":
+        try:
+            rate = float(args[1].replace(",", ".")) if len(args) > 1 else 0.1
+            chat_id = int(args[2]) if len(args) > 2 else None
+        except ValueError:
+            await update.message.reply_text(PROFILE_USAGE)
+            return
+        if not 0 < rate <= 1:
+            await update.message.reply_text("La frazione va da 0 (escluso) a 1.")
+            return
+        profiling.configure(rate, chat_id)
+    elif action == "off":
+        profiling.configure(0)
+        paths = profiling.dump()
+        await update.message.reply_text(f"Profili scritti: {len(paths)}")
+    elif action == "dump":
+        paths = profiling.dump()
+        await update.message.reply_text("\n".join(paths) or "Nessun profilo raccolto.")
+        return
+    elif action == "reset":
+        profiling.reset()
+    elif action:
+        await update.message.reply_text(PROFILE_USAGE)
+        return
+    await update.message.reply_text(profiling.status_text())
+
+def get_handlers(admin_chat_ids):
+    # solo le chat in ADMIN_CHAT_IDS: per tutti gli altri i comandi non esistono
+    admins = filters.Chat(chat_id=list(admin_chat_ids))
+    return [
+        CommandHandler("admin_stats", admin_stats, filters=admins),
+        CommandHandler("admin_profile", admin_profile, filters=admins),
+    ]
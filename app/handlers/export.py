@@ -1,47 +1,67 @@
 
+from typing import Optional, Set
 from telegram import Update, InputFile
 from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
-from app.storage import fetch_user_export
-import csv, io, pandas as pd
+from app import astorage
+from app.astorage import DBExecutor
+
+CAPTION = "Ecco l'export CSV + Excel"
+
+# Pool dedicato ai lavori pesanti (export, import): la compressione e il parsing
+# non occupano i thread delle query e al massimo `workers` ne girano in parallelo.
+_pool: Optional[DBExecutor] = None
+# Chat con un export in corso: una seconda richiesta non ne avvia un altro
+_in_progress: Set[int] = set()
+
+def configure(workers: int = 2):
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+    _pool = DBExecutor(workers, queue_size=workers * 4)
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+async def run_heavy(fn, *args):
+    """Esegue fn(*args) sul pool dei lavori pesanti."""
+    if _pool is None:
+        configure()
+    return await _pool.run(fn, *args)
+
+async def _build_and_send(update: Update, context: ContextTypes.DEFAULT_TYPE, version: Optional[int]):
+    chat_id = update.effective_chat.id
+    # import pigro: csv/zip/openpyxl si caricano solo al primo export
+    from app.exporter import build_export
+    archive = await run_heavy(build_export, context.bot_data["db_path"], chat_id)
+    with archive:
+        msg = await update.message.reply_document(
+            document=InputFile(archive, filename="export.zip", read_file_handle=False),
+            caption=CAPTION,
+        )
+    if version is not None and msg.document:
+        # stessa versione dei dati -> il prossimo /export rimanda lo stesso file già caricato
+        context.chat_data["export_cache"] = (version, msg.document.file_id)
 
 async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    data = fetch_user_export(context.bot_data["db_path"], chat_id)
-    # CSV zip in memoria
-    memzip = io.BytesIO()
-    import zipfile
-    with zipfile.ZipFile(memzip, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-        # vehicles.csv
-        v_csv = io.StringIO()
-        v_writer = csv.DictWriter(v_csv, fieldnames=["id","alias","plate","brand","model","year","notes","km_current","created_at","user_id"])
-        v_writer.writeheader()
-        for v in data["vehicles"]:
-            v_writer.writerow(v)
-        zf.writestr("vehicles.csv", v_csv.getvalue())
-        # maintenance.csv
-        m_csv = io.StringIO()
-        m_writer = csv.DictWriter(m_csv, fieldnames=["id","vehicle_id","date","km","type","notes","cost","created_at","alias"])
-        m_writer.writeheader()
-        for m in data["maintenance"]:
-            m_writer.writerow(m)
-        zf.writestr("maintenance.csv", m_csv.getvalue())
-        # reminders.csv
-        r_csv = io.StringIO()
-        r_writer = csv.DictWriter(r_csv, fieldnames=["id","vehicle_id","kind","due_at","km_threshold","description","active","created_at","alias"])
-        r_writer.writeheader()
-        for r in data["reminders"]:
-            r_writer.writerow(r)
-        zf.writestr("reminders.csv", r_csv.getvalue())
-        # Excel unico
-        with pd.ExcelWriter("export.xlsx") as writer:
-            pd.DataFrame(data["vehicles"]).to_excel(writer, sheet_name="vehicles", index=False)
-            pd.DataFrame(data["maintenance"]).to_excel(writer, sheet_name="maintenance", index=False)
-            pd.DataFrame(data["reminders"]).to_excel(writer, sheet_name="reminders", index=False)
-        with open("export.xlsx","rb") as f:
-            zf.writestr("export.xlsx", f.read())
-    memzip.seek(0)
-    await update.message.reply_document(document=InputFile(memzip, filename="export.zip"), caption="Ecco l'export CSV + Excel")
+    if chat_id in _in_progress:
+        await update.message.reply_text("⏳ Export già in preparazione, arriva tra poco.")
+        return
+    _in_progress.add(chat_id)
+    try:
+        version = await astorage.get_user_data_version(context.bot_data["db_path"], chat_id)
+        cached = context.chat_data.get("export_cache")
+        if cached and version is not None and cached[0] == version:
+            await update.message.reply_document(document=cached[1], caption=CAPTION)
+            return
+        await _build_and_send(update, context, version)
+    finally:
+        _in_progress.discard(chat_id)
 
 def get_handlers():
-    return [CommandHandler("export", export_cmd),
-            MessageHandler(filters.Regex("^📤 Esporta$"), export_cmd)]
+    # block=False: l'export gira come task a sé e non ferma gli altri update
+    return [CommandHandler("export", export_cmd, block=False),
+            MessageHandler(filters.Regex("^📤 Esporta$"), export_cmd, block=False)]
@@ -0,0 +1,83 @@
+
+import logging
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler, MessageHandler, ConversationHandler, filters
+from app.keyboards import cancel
+from app.handlers.export import run_heavy
+from app.handlers.reminders import check_km_reminders
+from app.utils.spool import SpooledBuffer
+
+logger = logging.getLogger(__name__)
+
+ASK_FILE = 0
+MAX_FILE_SIZE = 20 * 1024 * 1024  # limite di download dei file per i bot
+SPOOL_THRESHOLD = 8 * 1024 * 1024
+
+async def import_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "📥 Inviami il file con gli interventi: export.zip, maintenance.csv o export.xlsx "
+        "(stesse colonne di /export; il veicolo si indica con vehicle_id o alias).\n"
+        "/cancel per annullare."
+    )
+    return ASK_FILE
+
+def _summary(report) -> str:
+    lines = [f"Import completato ✅ {report.imported} interventi importati."]
+    if report.skipped:
+        lines.append(f"{report.skipped} già presenti, saltati.")
+    if report.created_vehicles:
+        lines.append("Nuovi veicoli: " + ", ".join(report.created_vehicles))
+    if report.error_count:
+        lines.append(f"⚠️ {report.error_count} righe scartate:")
+        lines += [f"• riga {line}: {reason}" for line, reason in report.errors]
+        if report.error_count > len(report.errors):
+            lines.append(f"… e altre {report.error_count - len(report.errors)}")
+    return "\n".join(lines)[:4096]
+
+async def import_receive(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    doc = update.message.document
+    if doc.file_size and doc.file_size > MAX_FILE_SIZE:
+        await update.message.reply_text("File troppo grande (max 20 MB). Dividilo in più parti e riprova.")
+        return ASK_FILE
+    await update.message.reply_text("⏳ Import in corso…")
+    # import pigro: csv/zip/openpyxl si caricano solo al primo import
+    from app.importer import ImportFormatError, import_file
+    with SpooledBuffer(max_size=SPOOL_THRESHOLD) as buf:
+        tg_file = await doc.get_file()
+        await tg_file.download_to_memory(buf)
+        buf.seek(0)
+        try:
+            report = await run_heavy(import_file, context.bot_data["db_path"], update.effective_chat.id,
+                                     buf, doc.file_name or "")
+        except ImportFormatError as e:
+            await update.message.reply_text(f"❌ File non importato: {e}.\nInviane un altro o /cancel.")
+            return ASK_FILE
+        except Exception:
+            # errore inatteso: l'utente deve comunque avere una risposta e uscire da ASK_FILE
+            logger.exception("Import fallito per la chat %s", update.effective_chat.id)
+            await update.message.reply_text("❌ Import non riuscito per un errore interno. Riprova più tardi.")
+            return ConversationHandler.END
+    await update.message.reply_text(_summary(report))
+    for vid, km in report.raised_km.items():
+        await check_km_reminders(context, vid, km)
+    return ConversationHandler.END
+
+async def import_expect_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text("Invia il file come documento (.csv, .xlsx o .zip) oppure /cancel.")
+    return ASK_FILE
+
+def get_handlers():
+    conv_import = ConversationHandler(
+        entry_points=[CommandHandler("import", import_start)],
+        states={
+            ASK_FILE: [
+                # block=False: download e parsing non fermano gli update delle altre chat
+                MessageHandler(filters.Document.ALL, import_receive, block=False),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, import_expect_file),
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        name="import_conv",
+        persistent=True,
+    )
+    return [conv_import]
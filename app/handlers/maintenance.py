@@ -2,9 +2,10 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler,
                           ConversationHandler, filters)
-from app import storage
-from app.utils.formatting import parse_date
+from app import astorage
+from app.utils.formatting import parse_date, format_maintenance
 from app.keyboards import cancel
+from app.handlers.reminders import check_km_reminders
 from datetime import date
 
 
@@ -16,24 +17,24 @@ async def add_type_cmd(update, context):
     if not context.args:
         return await update.message.reply_text("Uso: /add_type <nome tipo>")
     label = " ".join(context.args)
-    storage.add_type(context.bot_data["db_path"], update.effective_chat.id, label)
+    await astorage.add_type(context.bot_data["db_path"], update.effective_chat.id, label)
     await update.message.reply_text(f"Aggiunto: {label} ✅")
 
 async def list_types_cmd(update, context):
-    types = storage.list_types(context.bot_data["db_path"], update.effective_chat.id) or DEFAULT_COMMON_TYPES
+    types = await astorage.list_types(context.bot_data["db_path"], update.effective_chat.id) or DEFAULT_COMMON_TYPES
     await update.message.reply_text("Tipi disponibili:\n" + "\n".join(f"• {t}" for t in types))
 
 async def del_type_cmd(update, context):
     if not context.args:
         return await update.message.reply_text("Uso: /del_type <nome tipo>")
     label = " ".join(context.args)
-    ok = storage.delete_type(context.bot_data["db_path"], update.effective_chat.id, label)
+    ok = await astorage.delete_type(context.bot_data["db_path"], update.effective_chat.id, label)
     await update.message.reply_text("Rimosso ✅" if ok else "Tipo non trovato.")
 
 # Gestione Manutenzioni (Inserimento)
 async def add_maintenance_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    vehicles = storage.list_vehicles(context.bot_data["db_path"], chat_id)
+    vehicles = await astorage.list_vehicles(context.bot_data["db_path"], chat_id)
     if not vehicles:
         buttons = [[InlineKeyboardButton("🚗 Aggiungi Veicolo", callback_data=f"add_vehicle")]]
         await update.message.reply_text("Nessun veicolo ancora. Prima aggiungi un veicolo", reply_markup=InlineKeyboardMarkup(buttons))
@@ -44,7 +45,7 @@ async def add_maintenance_start(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def add_maintenance_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    types_from_db = storage.list_types(context.bot_data["db_path"], chat_id)
+    types_from_db = await astorage.list_types(context.bot_data["db_path"], chat_id)
     query = update.callback_query
     await query.answer()
     context.user_data["m_vehicle_id"] = int(query.data.split(":")[1])
@@ -114,7 +115,7 @@ async def add_maintenance_save(update: Update, context: ContextTypes.DEFAULT_TYP
         await update.message.reply_text("Inserisci un numero (es. 89.90) oppure '-' per saltare:")
         return ASK_COST
     vid = context.user_data["m_vehicle_id"]
-    rec_id = storage.add_maintenance(
+    rec_id = await astorage.add_maintenance(
         context.bot_data["db_path"],
         vehicle_id=vid,
         date_iso=context.user_data["m_date"],
@@ -123,14 +124,17 @@ async def add_maintenance_save(update: Update, context: ContextTypes.DEFAULT_TYP
         notes=context.user_data["m_notes"],
         cost=cost
     )
+    km = context.user_data["m_km"]
     context.user_data.clear()
     await update.message.reply_text(f"Intervento registrato ✅ (ID {rec_id})")
+    if km is not None:
+        await check_km_reminders(context, vid, km)
     return ConversationHandler.END
 
 # Gestione Manutenzioni (Storico)
 async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    vehicles = storage.list_vehicles(context.bot_data["db_path"], chat_id)
+    vehicles = await astorage.list_vehicles(context.bot_data["db_path"], chat_id)
     if not vehicles:
         buttons = [[InlineKeyboardButton("🚗 Aggiungi Veicolo", callback_data=f"add_vehicle")]]
         await update.message.reply_text("Nessun veicolo ancora. Prima aggiungi un veicolo", reply_markup=InlineKeyboardMarkup(buttons))
@@ -138,45 +142,47 @@ async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     buttons = [[InlineKeyboardButton((v["alias"] or v["brand"] or '') + ' ' + (v["model"] or ''), callback_data=f"hv:{v['id']}")] for v in vehicles]
     await update.message.reply_text("Storico per quale veicolo?", reply_markup=InlineKeyboardMarkup(buttons))
 
-async def history_show_from_vehicle(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    vid = int(query.data.split(":")[1])
-    recs = storage.list_maintenance(context.bot_data["db_path"], vid, limit=30)
-    if not recs:
-        await query.edit_message_text("Nessun intervento registrato.")
-        return
-    lines = []
-    for r in recs:
-        line = f"• {r['date']} — {r['type']}"
-        if r["km"]:
-            line += f" ({r['km']} km)"
-        if r["cost"]:
-            line += f" — €{r['cost']:.2f}"
-        if r["notes"]:
-            line += f" — {r['notes']}"
-        lines.append(line)
-    await query.edit_message_text("\n".join(lines))
+HISTORY_PAGE_SIZE = 10
+# una riga non supera HISTORY_MAX_LINE caratteri: una pagina intera resta sotto i 4096 di Telegram
+HISTORY_MAX_LINE = 350
+
+def _history_cursor(vid: int, direction: str, r) -> str:
+    # callback_data (max 64 byte): hp:<veicolo>:<o=più vecchi|n=più recenti>:<data>:<id>
+    return f"hp:{vid}:{direction}:{r['date']}:{r['id']}"
 
 async def history_show(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Una pagina di storico: apertura da hv:/vehhist: o navigazione ◀/▶ da hp:."""
     query = update.callback_query
     await query.answer()
-    vid = int(query.data.split(":")[1])
-    recs = storage.list_maintenance(context.bot_data["db_path"], vid, limit=30)
+    parts = query.data.split(":")
+    vid = int(parts[1])
+    before = after = None
+    if parts[0] == "hp":
+        cursor = (parts[3], int(parts[4]))
+        if parts[2] == "o":
+            before = cursor
+        else:
+            after = cursor
+    # una riga in più dice se oltre questa pagina ce n'è un'altra
+    recs = await astorage.list_maintenance(context.bot_data["db_path"], vid, limit=HISTORY_PAGE_SIZE + 1,
+                                           before=before, after=after)
+    more = len(recs) > HISTORY_PAGE_SIZE
+    if after is not None:
+        recs = recs[-HISTORY_PAGE_SIZE:]
+        has_newer, has_older = more, True
+    else:
+        recs = recs[:HISTORY_PAGE_SIZE]
+        has_newer, has_older = before is not None, more
     if not recs:
-        await query.edit_message_text("Nessun intervento registrato.")
+        await query.edit_message_text("Nessun intervento registrato." if parts[0] != "hp" else "Nessun altro intervento.")
         return
-    lines = []
-    for r in recs:
-        line = f"• {r['date']} — {r['type']}"
-        if r["km"]:
-            line += f" ({r['km']} km)"
-        if r["cost"]:
-            line += f" — €{r['cost']:.2f}"
-        if r["notes"]:
-            line += f" — {r['notes']}"
-        lines.append(line)
-    await query.edit_message_text("\n".join(lines))
+    nav = []
+    if has_newer:
+        nav.append(InlineKeyboardButton("◀ Più recenti", callback_data=_history_cursor(vid, "n", recs[0])))
+    if has_older:
+        nav.append(InlineKeyboardButton("Più vecchi ▶", callback_data=_history_cursor(vid, "o", recs[-1])))
+    await query.edit_message_text("\n".join(format_maintenance(r, HISTORY_MAX_LINE) for r in recs),
+                                  reply_markup=InlineKeyboardMarkup([nav]) if nav else None)
 
 # Gestione Handlers
 def get_handlers():
@@ -200,8 +206,7 @@ def get_handlers():
     return [
         conv_add,
         CommandHandler("history", history),
-        CallbackQueryHandler(history_show_from_vehicle, pattern="^vehhist:"),
-        CallbackQueryHandler(history_show, pattern="^hv:"),
+        CallbackQueryHandler(history_show, pattern="^(hv|vehhist|hp):"),
         CommandHandler("add_type", add_type_cmd),
         CommandHandler("list_types", list_types_cmd),
         CommandHandler("del_type", del_type_cmd),
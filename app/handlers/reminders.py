@@ -2,7 +2,7 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler,
                           ConversationHandler, filters)
-from app import storage
+from app import astorage, notifications, scheduler
 from app.utils.formatting import parse_datetime
 from datetime import datetime, timedelta
 from app.keyboards import cancel
@@ -13,7 +13,7 @@ ASK_VEH_KM, ASK_KM, ASK_DESC_KM = range(3,6)
 
 async def set_time_reminder_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    vehicles = storage.list_vehicles(context.bot_data["db_path"], chat_id)
+    vehicles = await astorage.list_vehicles(context.bot_data["db_path"], chat_id)
     if not vehicles:
         await update.message.reply_text("Prima aggiungi un veicolo con /add_vehicle.")
         return ConversationHandler.END
@@ -49,33 +49,60 @@ async def set_time_reminder_desc(update: Update, context: ContextTypes.DEFAULT_T
 async def set_time_reminder_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
     desc = update.message.text.strip()
     vid = context.user_data["r_vehicle_id"]
-    rem_id = storage.add_time_reminder(context.bot_data["db_path"], vid, context.user_data["r_when"], desc)
-    # schedule job
-    await schedule_time_reminder_job(context, rem_id, vid, context.user_data["r_when"], desc, chat_id=update.effective_chat.id)
+    rem_id = await astorage.add_time_reminder(context.bot_data["db_path"], vid, context.user_data["r_when"], desc)
+    # entra subito nella finestra dello scheduler se scade a breve; fuori dal leader
+    # (o oltre la finestra) lo trovano pickup e ricariche
+    scheduler.add(rem_id, context.user_data["r_when"], update.effective_chat.id, vid, desc)
     context.user_data.clear()
     await update.message.reply_text("Promemoria a data/ora impostato ✅")
     return ConversationHandler.END
 
-async def schedule_time_reminder_job(context: ContextTypes.DEFAULT_TYPE, reminder_id: int, vehicle_id: int, due_at_iso: str, description: str, chat_id: int):
-    tzname = context.bot_data.get("tz", "Europe/Rome")
-    tz = pytz.timezone(tzname)
-    dt = datetime.fromisoformat(due_at_iso)
-    if dt.tzinfo is None:
-        dt = tz.localize(dt)
-    async def callback(ctx: ContextTypes.DEFAULT_TYPE):
-        await ctx.bot.send_message(chat_id=chat_id, text=f"⏰ Promemoria: {description} (veicolo ID {vehicle_id})")
-        storage.deactivate_reminder(ctx.bot_data["db_path"], reminder_id)
-    context.job_queue.run_once(
-        callback,
-        when=dt,
-        name=f"rem_time_{reminder_id}",
-        data={"reminder_id": reminder_id, "vehicle_id": vehicle_id, "chat_id": chat_id, "description": description}
-    )
+# Pianificazione sotto lease (app/leader.py): solo il processo leader fa girare lo
+# scheduler dei promemoria (app/scheduler.py) e il controllo km; i promemoria
+# creati da altri processi e in scadenza dentro la finestra già caricata li
+# raccoglie pickup_new_reminders_job scorrendo gli id successivi all'ultimo visto.
+PICKUP_INTERVAL = 30
+PICKUP_BATCH = 1000
+_last_reminder_id = 0
+
+async def pickup_new_reminders_job(context: ContextTypes.DEFAULT_TYPE):
+    global _last_reminder_id
+    while True:
+        batch = await astorage.list_active_time_reminders_batch(context.bot_data["db_path"], _last_reminder_id, PICKUP_BATCH)
+        if not batch:
+            return
+        for r in batch:
+            scheduler.add(r["id"], r["due_at"], r["chat_id"], r["vehicle_id"], r["description"])
+        _last_reminder_id = batch[-1]["id"]
+
+async def start_scheduling(app, pickup_interval: float = PICKUP_INTERVAL, horizon: float = scheduler.DEFAULT_HORIZON) -> int:
+    """Il processo è diventato leader: avvia lo scheduler dei promemoria e i job periodici.
+    Ritorna quanti promemoria sono nella prima finestra."""
+    global _last_reminder_id
+    # prima l'ultimo id, poi la finestra: ciò che nasce in mezzo lo vede il pickup
+    _last_reminder_id = await astorage.get_max_reminder_id(app.bot_data["db_path"])
+    sched = await scheduler.configure(app.bot_data["db_path"], app.bot_data.get("tz", "Europe/Rome"), horizon)
+    app.job_queue.run_repeating(pickup_new_reminders_job, interval=pickup_interval, first=pickup_interval, name="rem_pickup")
+    # Pianifica job giornaliero per km (alle 09:00 locali)
+    tz = pytz.timezone(app.bot_data.get("tz", "Europe/Rome"))
+    now_local = datetime.now(tz)
+    first_time = now_local.replace(hour=9, minute=0, second=0, microsecond=0)
+    if first_time < now_local:
+        first_time += timedelta(days=1)
+    app.job_queue.run_repeating(km_checker_job, interval=86400, first=first_time, name="km_checker")
+    return len(sched)
+
+async def stop_scheduling(app):
+    """Il processo non è più leader: ferma lo scheduler e toglie i job periodici."""
+    await scheduler.shutdown()
+    for job in app.job_queue.jobs():
+        if job.name in ("rem_pickup", "km_checker"):
+            job.schedule_removal()
 
 # KM Reminder
 async def set_km_reminder_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    vehicles = storage.list_vehicles(context.bot_data["db_path"], chat_id)
+    vehicles = await astorage.list_vehicles(context.bot_data["db_path"], chat_id)
     if not vehicles:
         await update.message.reply_text("Prima aggiungi un veicolo con /add_vehicle.")
         return ConversationHandler.END
@@ -103,30 +130,26 @@ async def set_km_reminder_save(update: Update, context: ContextTypes.DEFAULT_TYP
     desc = update.message.text.strip()
     vid = context.user_data["rk_vehicle_id"]
     km_thr = context.user_data["rk_km"]
-    rem_id = storage.add_km_reminder(context.bot_data["db_path"], vid, km_thr, desc)
+    rem_id = await astorage.add_km_reminder(context.bot_data["db_path"], vid, km_thr, desc)
     context.user_data.clear()
     await update.message.reply_text("Promemoria km impostato ✅. Sarai avvisato quando superi la soglia.")
     return ConversationHandler.END
 
-# Daily checker for KM reminders
+def _notify_km_reminder(r):
+    notifications.notify(r["chat_id"], f"⏰ Promemoria km: {r['description']} (veicolo {r['alias']}) - soglia {r['km_threshold']} km raggiunta/superata.", r["id"])
+
+async def check_km_reminders(context: ContextTypes.DEFAULT_TYPE, vehicle_id: int, km: int):
+    """Da chiamare dopo ogni aggiornamento del contachilometri: avvisa subito per le soglie superate."""
+    rows = await astorage.list_crossed_km_reminders(context.bot_data["db_path"], vehicle_id, km)
+    for r in rows:
+        _notify_km_reminder(r)
+
+# Daily checker for KM reminders: controllo di sicurezza, gli avvisi partono già da check_km_reminders
 async def km_checker_job(context: ContextTypes.DEFAULT_TYPE):
-    rows = storage.list_active_km_reminders(context.bot_data["db_path"])
+    rows = await astorage.list_active_km_reminders(context.bot_data["db_path"])
     for r in rows:
         if r["km_threshold"] is not None and r["km_current"] is not None and r["km_current"] >= r["km_threshold"]:
-            # fetch chat id via vehicle->user_id->users.chat_id
-            # quick join to get chat
-            # For simplicity we added user_id above in query; now we need chat_id:
-            # We'll query users by id
-            import sqlite3
-            conn = sqlite3.connect(context.bot_data["db_path"])
-            try:
-                cur = conn.cursor()
-                cur.execute("SELECT chat_id FROM users WHERE id = ?", (r["user_id"],))
-                chat_id = cur.fetchone()[0]
-            finally:
-                conn.close()
-            await context.bot.send_message(chat_id=chat_id, text=f"⏰ Promemoria km: {r['description']} (veicolo {r['alias']}) - soglia {r['km_threshold']} km raggiunta/superata.")
-            storage.deactivate_reminder(context.bot_data["db_path"], r["id"])
+            _notify_km_reminder(r)
 
 def get_handlers():
     conv_time = ConversationHandler(
@@ -0,0 +1,70 @@
+
+import re
+from typing import Optional
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from app import astorage
+from app.utils.formatting import clean_plate, format_maintenance
+
+SEARCH_PAGE_SIZE = 10
+SEARCH_MAX_LINE = 350  # come lo storico: una pagina resta sotto i 4096 caratteri
+SEARCH_MAX_TERMS = 8
+SEARCH_MAX_ECHO = 100  # testo della ricerca ripetuto nella risposta, non oltre
+
+def build_match(text: str) -> Optional[str]:
+    """Testo libero -> query FTS5: ogni parola come prefisso, tutte richieste.
+
+    Se il testo sembra una targa (es. 'AB 123 CD') si cerca anche la targa normalizzata.
+    """
+    terms = re.findall(r"\w+", text.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    match = " ".join(f'"{t}"*' for t in terms)
+    plate = clean_plate(text)
+    if len(terms) > 1 and len(plate) >= 5 and any(c.isdigit() for c in plate):
+        match = f'({match}) OR vehicle:"{plate}"*'
+    return match
+
+def _echo(text: str) -> str:
+    return text if len(text) <= SEARCH_MAX_ECHO else text[:SEARCH_MAX_ECHO - 1] + "…"
+
+async def _show_results(context: ContextTypes.DEFAULT_TYPE, chat_id: int, text: str, offset: int):
+    match = build_match(text)
+    if match is None:
+        return "Uso: /search <testo> (es. /search pastiglie freni ducato)", None
+    # una riga in più dice se c'è una pagina successiva
+    recs = await astorage.search_maintenance(context.bot_data["db_path"], chat_id, match,
+                                             limit=SEARCH_PAGE_SIZE + 1, offset=offset)
+    if not recs:
+        return (f"Nessun intervento trovato per “{_echo(text)}”." if offset == 0 else "Nessun altro risultato."), None
+    lines = [f"🔎 {_echo(text)}"]
+    lines += [format_maintenance(r, SEARCH_MAX_LINE, vehicle=r["alias"] or r["plate"]) for r in recs[:SEARCH_PAGE_SIZE]]
+    nav = []
+    if offset > 0:
+        nav.append(InlineKeyboardButton("◀", callback_data=f"sp:{max(0, offset - SEARCH_PAGE_SIZE)}"))
+    if len(recs) > SEARCH_PAGE_SIZE:
+        nav.append(InlineKeyboardButton("▶", callback_data=f"sp:{offset + SEARCH_PAGE_SIZE}"))
+    return "\n".join(lines), InlineKeyboardMarkup([nav]) if nav else None
+
+async def search_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = " ".join(context.args or []).strip()
+    # l'ultima ricerca resta in chat_data: callback_data (64 byte) porta solo la posizione
+    context.chat_data["search_q"] = text
+    msg, markup = await _show_results(context, update.effective_chat.id, text, 0)
+    await update.message.reply_text(msg, reply_markup=markup)
+
+async def search_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    text = context.chat_data.get("search_q")
+    if not text:
+        await query.edit_message_text("Ricerca scaduta, ripeti /search.")
+        return
+    msg, markup = await _show_results(context, update.effective_chat.id, text, int(query.data.split(":")[1]))
+    await query.edit_message_text(msg, reply_markup=markup)
+
+def get_handlers():
+    return [
+        CommandHandler("search", search_cmd),
+        CallbackQueryHandler(search_page, pattern="^sp:"),
+    ]
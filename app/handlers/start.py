@@ -17,9 +17,12 @@ HELP = (
     "/update_km - aggiorna chilometraggio\n"
     "/add_maintenance - aggiungi intervento\n"
     "/history - storico interventi\n"
+    "/stats - spese e chilometri per veicolo\n"
+    "/search - cerca negli interventi (tipo, note, veicolo, targa)\n"
     "/set_time_reminder - promemoria a data/ora\n"
     "/set_km_reminder - promemoria al raggiungimento km\n"
-    "/export - esporta dati in CSV/XLSX"
+    "/export - esporta dati in CSV/XLSX\n"
+    "/import - importa interventi da CSV/XLSX/ZIP"
 )
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
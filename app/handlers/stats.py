@@ -0,0 +1,58 @@
+
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler
+from app import astorage
+
+STATS_TOP_TYPES = 5
+MESSAGE_LIMIT = 4096  # caratteri massimi di un messaggio Telegram
+
+def _vehicle_stats(s) -> str:
+    name = ((s["alias"] or s["brand"] or '') + ' ' + (s["model"] or '')).strip() or f"Veicolo {s['id']}"
+    lines = [f"🚗 {name}"]
+    if not s["count"]:
+        lines.append("Nessun intervento registrato.")
+        return "\n".join(lines)
+    lines.append(f"Interventi: {s['count']} — spesa totale €{s['total_cost']:.2f}")
+    last = f"Ultimo intervento: {s['last_date']}"
+    if s["last_km"]:
+        last += f" ({s['last_km']} km)"
+    lines.append(last)
+    # €/1000 km sui km percorsi dal primo intervento con km a oggi
+    if s["first_km"] is not None and s["km_current"] and s["km_current"] > s["first_km"]:
+        per_1000 = s["total_cost"] / (s["km_current"] - s["first_km"]) * 1000
+        lines.append(f"Costo medio: €{per_1000:.2f} ogni 1000 km")
+    for t in s["types"][:STATS_TOP_TYPES]:
+        lines.append(f"• {t['type']}: {t['count']}× — €{t['total_cost']:.2f}")
+    return "\n".join(lines)
+
+def _pack(blocks, limit: int = MESSAGE_LIMIT):
+    """Raggruppa i blocchi (uno per veicolo) in messaggi sotto il limite, senza spezzarli."""
+    messages, current = [], ""
+    for block in blocks:
+        block = block[:limit]
+        if current and len(current) + 2 + len(block) > limit:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n\n{block}" if current else block
+    if current:
+        messages.append(current)
+    return messages
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    summaries = await astorage.get_user_summary(context.bot_data["db_path"], update.effective_chat.id)
+    if not summaries:
+        await update.message.reply_text("Nessun veicolo ancora. Prima aggiungi un veicolo con /add_vehicle")
+        return
+    # con molti veicoli il riepilogo supera un messaggio: più messaggi, tagliati tra un veicolo e l'altro
+    for text in _pack(_vehicle_stats(s) for s in summaries):
+        await update.message.reply_text(text)
+
+async def rebuild_stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    n = await astorage.rebuild_summaries(context.bot_data["db_path"], update.effective_chat.id)
+    await update.message.reply_text(f"Statistiche ricalcolate ✅ ({n} veicoli con interventi)")
+
+def get_handlers():
+    return [
+        CommandHandler("stats", stats_cmd),
+        CommandHandler("rebuild_stats", rebuild_stats_cmd),
+    ]
@@ -2,9 +2,10 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler,
                           ConversationHandler, filters)
-from app import storage
+from app import astorage
 from app.keyboards import main_menu, vehicles_inline, vehicle_actions, cancel
 from app.utils.formatting import clean_plate
+from app.handlers.reminders import check_km_reminders
 
 ASK_ALIAS, ASK_PLATE, ASK_BRAND, ASK_MODEL, ASK_YEAR, ASK_NOTES = range(6)
 ASK_KM_VEHICLE, ASK_KM_VALUE = range(6,8)
@@ -12,7 +13,7 @@ ASK_KM_VEHICLE, ASK_KM_VALUE = range(6,8)
 # Gestione Veicoli (Lista)
 async def list_vehicles(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    vehicles = storage.list_vehicles(context.bot_data["db_path"], chat_id)
+    vehicles = await astorage.list_vehicles(context.bot_data["db_path"], chat_id)
     if not vehicles:
         buttons = [[InlineKeyboardButton("🚗 Aggiungi Veicolo", callback_data=f"add_vehicle")]]
         await update.message.reply_text("Nessun veicolo ancora. Prima aggiungi un veicolo", reply_markup=InlineKeyboardMarkup(buttons))
@@ -24,7 +25,7 @@ async def on_vehicle_pressed(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     vid = int(query.data.split(":")[1])
-    v = storage.get_vehicle(context.bot_data["db_path"], vid)
+    v = await astorage.get_vehicle(context.bot_data["db_path"], vid)
     if not v:
         await query.edit_message_text("Quel veicolo non esiste più.")
         return
@@ -69,7 +70,7 @@ async def add_vehicle_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
     notes_s = update.message.text.strip()
     context.user_data["notes"] = None if notes_s == "-" else notes_s
     chat_id = update.effective_chat.id
-    vid = storage.add_vehicle(
+    vid = await astorage.add_vehicle(
         context.bot_data["db_path"],
         chat_id=chat_id,
         alias=context.user_data.get("alias"),
@@ -86,12 +87,11 @@ async def add_vehicle_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Gestione Veicoli (Aggiorna Chilometraggio)
 async def update_km_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    vehicles = storage.list_vehicles(context.bot_data["db_path"], chat_id)
+    vehicles = await astorage.list_vehicles(context.bot_data["db_path"], chat_id)
     if not vehicles:
         buttons = [[InlineKeyboardButton("🚗 Aggiungi Veicolo", callback_data=f"add_vehicle")]]
         await update.message.reply_text("Nessun veicolo ancora. Prima aggiungi un veicolo", reply_markup=InlineKeyboardMarkup(buttons))
         return ConversationHandler.END
-    context.user_data["km_choose_map"] = {str(v["id"]): v for v in vehicles}
     buttons = [[InlineKeyboardButton((v["alias"] or v["brand"] or '') + ' ' + (v["model"] or ''), callback_data=f"kmv:{v['id']}")] for v in vehicles]
     await update.message.reply_text("Seleziona veicolo:", reply_markup=InlineKeyboardMarkup(buttons))
     return ASK_KM_VEHICLE
@@ -119,9 +119,10 @@ async def update_km_save(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Formato non valido. Scrivi solo numeri (es. 123456).")
         return ASK_KM_VALUE
     vid = context.user_data.get("km_vehicle_id")
-    storage.update_vehicle_km(context.bot_data["db_path"], vid, int(km_s))
+    await astorage.update_vehicle_km(context.bot_data["db_path"], vid, int(km_s))
     context.user_data.pop("km_vehicle_id", None)
     await update.message.reply_text("Chilometraggio aggiornato ✅")
+    await check_km_reminders(context, vid, int(km_s))
     return ConversationHandler.END
 
 # Gestione Veicoli (Elimina Veicolo)
@@ -129,7 +130,7 @@ async def delete_vehicle_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     vid = int(query.data.split(":")[1])
-    storage.delete_vehicle(context.bot_data["db_path"], vid)
+    await astorage.delete_vehicle(context.bot_data["db_path"], vid)
     await query.edit_message_text("Veicolo eliminato ✅")
 
 # Gestione Handlers
@@ -0,0 +1,230 @@
+"""
+Import degli interventi da file: maintenance.csv, export.xlsx (foglio
+"maintenance") oppure l'intero export.zip prodotto da /export.
+
+Le colonne sono quelle dell'export (vedi exporter.MAINTENANCE_FIELDS): servono
+`date`, `type` e il veicolo, indicato da `vehicle_id` (se è un veicolo
+dell'utente) oppure da `alias` (se non esiste viene creato). Le righe vengono
+lette una alla volta, validate con i parser di app/utils/formatting.py e
+inserite a blocchi di IMPORT_BATCH, ognuno in una transazione breve.
+
+import_file è sincrona: va eseguita fuori dall'event loop, in un unico thread.
+"""
+import csv
+import io
+import zipfile
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app import storage
+from app.utils.formatting import parse_date, parse_euro, parse_km
+
+IMPORT_BATCH = 2000
+MAX_REPORTED_ERRORS = 20
+REQUIRED_FIELDS = ("date", "type")
+
+
+class ImportFormatError(ValueError):
+    """File non leggibile o senza le colonne minime."""
+
+
+@dataclass
+class ImportReport:
+    imported: int = 0
+    skipped: int = 0  # interventi già presenti (stesso id e stessi dati)
+    created_vehicles: List[str] = field(default_factory=list)
+    errors: List[Tuple[int, str]] = field(default_factory=list)  # (riga, motivo)
+    error_count: int = 0
+    raised_km: Dict[int, int] = field(default_factory=dict)  # vehicle_id -> nuovi km
+
+    def error(self, line: int, reason: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, reason))
+
+
+# --- lettura a flusso: ogni sorgente produce (numero riga, dict colonna -> valore) ---
+
+def _iter_csv(raw) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    f = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.DictReader(f)
+        try:
+            _check_header(reader.fieldnames)
+            for row in reader:
+                yield reader.line_num, row
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise ImportFormatError(f"CSV non leggibile dopo la riga {reader.line_num} ({e.__class__.__name__})") from e
+    finally:
+        f.detach()
+
+
+def _iter_xlsx(raw) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    from openpyxl import load_workbook
+
+    # read-only: le righe si leggono dal file man mano, il foglio non sta tutto in memoria
+    try:
+        wb = load_workbook(raw, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFormatError(f"file Excel non leggibile ({e.__class__.__name__})") from e
+    try:
+        ws = wb["maintenance"] if "maintenance" in wb.sheetnames else wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else "" for h in next(rows, ())]
+        _check_header(header)
+        for n, values in enumerate(rows, start=2):
+            if values and any(v is not None for v in values):
+                yield n, dict(zip(header, values))
+    finally:
+        wb.close()
+
+
+def _iter_zip(raw) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    try:
+        zf = zipfile.ZipFile(raw)
+    except zipfile.BadZipFile as e:
+        raise ImportFormatError("archivio zip non valido") from e
+    with zf:
+        names = zf.namelist()
+        if "maintenance.csv" in names:
+            with zf.open("maintenance.csv") as f:
+                yield from _iter_csv(f)
+        elif "export.xlsx" in names:
+            with zf.open("export.xlsx") as f:
+                yield from _iter_xlsx(f)
+        else:
+            raise ImportFormatError("nello zip non c'è maintenance.csv né export.xlsx")
+
+
+def _check_header(fields):
+    fields = set(fields or ())
+    missing = [f for f in REQUIRED_FIELDS if f not in fields]
+    if missing or not fields & {"vehicle_id", "alias"}:
+        raise ImportFormatError("colonne mancanti: servono date, type e vehicle_id o alias")
+
+
+def iter_rows(fileobj, filename: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    name = filename.lower()
+    if name.endswith(".zip"):
+        return _iter_zip(fileobj)
+    if name.endswith(".xlsx"):
+        return _iter_xlsx(fileobj)
+    if name.endswith(".csv"):
+        return _iter_csv(fileobj)
+    raise ImportFormatError("formato non supportato: invia un file .csv, .xlsx o .zip")
+
+
+# --- validazione ---
+
+def _text(v) -> Optional[str]:
+    if v is None:
+        return None
+    s = str(v).strip()
+    return s or None
+
+
+def _to_date(v, parse=parse_date) -> Optional[str]:
+    if isinstance(v, datetime):
+        return v.date().isoformat()
+    if isinstance(v, date):
+        return v.isoformat()
+    return parse(_text(v) or "")
+
+
+def _to_int(v) -> Optional[int]:
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return int(v)
+    return parse_km(_text(v) or "")
+
+
+def _to_float(v) -> Optional[float]:
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return float(v)
+    return parse_euro(_text(v) or "")
+
+
+def _same_row(stored: tuple, row: tuple) -> bool:
+    """Riga importata uguale all'intervento salvato: (vehicle_id, date, type, km, cost)."""
+    (s_vid, s_date, s_type, s_km, s_cost), (vid, d_iso, mtype, km, cost) = stored, row
+    if (s_vid, s_date, s_type, s_km) != (vid, d_iso, mtype, km):
+        return False
+    if s_cost is None or cost is None:
+        return s_cost is None and cost is None
+    return abs(s_cost - cost) < 0.005
+
+
+def import_file(db_path: str, chat_id: int, fileobj, filename: str, batch_size: int = IMPORT_BATCH) -> ImportReport:
+    """Importa gli interventi del file nei veicoli dell'utente e ritorna il resoconto.
+    Solleva ImportFormatError se il file non è utilizzabile."""
+    report = ImportReport()
+    targets = storage.get_import_targets(db_path, chat_id)
+    vehicles: Dict[int, Optional[str]] = targets["vehicles"]
+    by_alias = {alias.strip().lower(): vid for vid, alias in vehicles.items() if alias}
+    # gli id sono globali: uno stesso numero in un file esterno può essere un altro
+    # intervento, quindi si salta solo se anche i dati coincidono
+    existing = targets["maintenance"]
+    # in un file le stesse date si ripetono: strptime una volta sola per valore
+    parse = lru_cache(maxsize=8192)(parse_date)
+
+    batch: List[tuple] = []
+    rows = iter_rows(fileobj, filename)
+    line = 0
+    while True:
+        try:
+            line, row = next(rows)
+        except StopIteration:
+            break
+        except ImportFormatError as e:
+            if line == 0:
+                raise
+            # file rotto a metà: si tiene quanto letto finora
+            report.error(line + 1, str(e))
+            break
+        d_iso = _to_date(row.get("date"), parse)
+        if d_iso is None:
+            report.error(line, f"data non valida: {row.get('date')!r}")
+            continue
+        mtype = _text(row.get("type"))
+        if mtype is None:
+            report.error(line, "tipo di intervento mancante")
+            continue
+        km = cost = None
+        if _text(row.get("km")) is not None:
+            km = _to_int(row.get("km"))
+            if km is None or km < 0:
+                report.error(line, f"km non validi: {row.get('km')!r}")
+                continue
+        if _text(row.get("cost")) is not None:
+            cost = _to_float(row.get("cost"))
+            if cost is None:
+                report.error(line, f"costo non valido: {row.get('cost')!r}")
+                continue
+
+        vid = _to_int(row.get("vehicle_id"))
+        if vid not in vehicles:
+            alias = _text(row.get("alias"))
+            if alias is None:
+                report.error(line, "veicolo non trovato (manca l'alias)")
+                continue
+            vid = by_alias.get(alias.lower())
+            if vid is None:
+                vid = storage.add_vehicle(db_path, chat_id, alias, None, None, None, None, None)
+                vehicles[vid] = alias
+                by_alias[alias.lower()] = vid
+                report.created_vehicles.append(alias)
+
+        stored = existing.get(_to_int(row.get("id")))
+        if stored is not None and _same_row(stored, (vid, d_iso, mtype, km, cost)):
+            report.skipped += 1
+            continue
+        batch.append((vid, d_iso, km, mtype, _text(row.get("notes")), cost))
+        if len(batch) >= batch_size:
+            report.imported += storage.insert_maintenance_batch(db_path, batch)
+            batch = []
+    if batch:
+        report.imported += storage.insert_maintenance_batch(db_path, batch)
+    if report.imported:
+        report.raised_km = storage.finish_import(db_path, chat_id)
+    return report
@@ -0,0 +1,112 @@
+"""
+Lease "leader" sul DB condiviso: fra più processi del bot uno solo pianifica i
+promemoria e il controllo km giornaliero.
+
+Ogni processo prova a prendere il lease a ogni heartbeat (ttl/3): chi lo tiene
+lo rinnova, gli altri restano in attesa. Se il leader muore o si blocca il lease
+scade dopo `ttl` secondi e il primo processo che riprova lo prende (failover).
+Chi non riesce a rinnovarlo in tempo smette subito di pianificare.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Optional
+
+from app import astorage
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "scheduler"
+DEFAULT_TTL = 30.0
+
+
+class LeaderLease:
+    def __init__(self, db_path: str, on_acquire: Callable[[], Awaitable[None]],
+                 on_release: Callable[[], Awaitable[None]], name: str = LEASE_NAME,
+                 ttl: float = DEFAULT_TTL, holder: Optional[str] = None):
+        self.db_path = db_path
+        self.name = name
+        self.ttl = ttl
+        self.interval = ttl / 3
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = False
+        self._on_acquire = on_acquire
+        self._on_release = on_release
+        self._renewed_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Primo tentativo subito (il leader pianifica già durante l'avvio), poi heartbeat periodico."""
+        await self.tick()
+        self._task = asyncio.create_task(self._loop(), name=f"lease-{self.name}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            await self._step_down()
+            # rilascio esplicito: chi subentra non aspetta la scadenza
+            await astorage.release_lease(self.db_path, self.name, self.holder)
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.tick()
+
+    async def tick(self):
+        try:
+            held = await astorage.acquire_lease(self.db_path, self.name, self.holder, self.ttl)
+        except Exception:
+            logger.exception("Heartbeat del lease %s non riuscito", self.name)
+            # margine di un heartbeat: il lease scade a rinnovo + ttl, poi un altro può prenderlo
+            held = self.is_leader and time.monotonic() - self._renewed_at < self.ttl - self.interval
+        else:
+            if held:
+                self._renewed_at = time.monotonic()
+        if held and not self.is_leader:
+            logger.info("Lease %s preso da %s", self.name, self.holder)
+            self.is_leader = True
+            try:
+                await self._on_acquire()
+            except Exception:
+                logger.exception("Avvio del leader non riuscito, lease %s rilasciato", self.name)
+                await self._step_down()
+                await astorage.release_lease(self.db_path, self.name, self.holder)
+        elif not held and self.is_leader:
+            logger.warning("Lease %s perso da %s", self.name, self.holder)
+            await self._step_down()
+
+    async def _step_down(self):
+        self.is_leader = False
+        try:
+            await self._on_release()
+        except Exception:
+            logger.exception("Errore fermando il leader del lease %s", self.name)
+
+
+_lease: Optional[LeaderLease] = None
+
+
+async def configure(db_path: str, on_acquire: Callable[[], Awaitable[None]],
+                    on_release: Callable[[], Awaitable[None]], ttl: float = DEFAULT_TTL) -> LeaderLease:
+    """Crea il lease e fa il primo tentativo. Da chiamare in post_init."""
+    global _lease
+    _lease = LeaderLease(db_path, on_acquire, on_release, ttl=ttl)
+    await _lease.start()
+    return _lease
+
+
+def is_leader() -> bool:
+    # senza lease configurato (script, prove) il processo è l'unico: pianifica lui
+    return _lease is None or _lease.is_leader
+
+
+async def shutdown():
+    global _lease
+    if _lease is not None:
+        await _lease.stop()
+        _lease = None
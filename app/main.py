@@ -1,69 +1,127 @@
 
-from telegram.ext import ApplicationBuilder, PicklePersistence
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from telegram.ext import ApplicationBuilder
 from telegram.ext import MessageHandler, filters
 from telegram import Update
 from app.config import config
-from app import storage
+from app import astorage, leader, metrics, notifications, profiling, storage
+from app.persistence import SQLitePersistence
 from app.handlers import start as h_start
 from app.handlers import vehicles as h_vehicles
 from app.handlers import maintenance as h_maint
 from app.handlers import reminders as h_rem
 from app.handlers import export as h_export
+from app.handlers import stats as h_stats
+from app.handlers import search as h_search
+from app.handlers import importing as h_import
+from app.handlers import admin as h_admin
 from app.keyboards import main_menu
-import pytz
-from datetime import datetime
+from app.utils.timing import PhaseTimer
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tempi delle fasi di avvio, riassunti nel log a fine post_init
+startup = PhaseTimer(started=_IMPORT_STARTED)
+startup.record("import", time.perf_counter() - _IMPORT_STARTED)
+
+async def _start_scheduling(app):
+    loaded = await h_rem.start_scheduling(app, config.reminder_pickup_interval, config.reminder_horizon)
+    logger.info("Scheduler promemoria avviato: %d in scadenza entro %.0fs", loaded, config.reminder_horizon)
 
 async def post_init(app):
-    # Inizializza DB
-    storage.init_db(config.db_path)
     app.bot_data["db_path"] = config.db_path
     app.bot_data["tz"] = config.tz
-    # Ripianifica promemoria a data/ora esistenti
-    rows = storage.list_active_time_reminders(config.db_path)
-    for r in rows:
-        # serve chat_id dall'utente
-        import sqlite3
-        conn = sqlite3.connect(config.db_path)
-        try:
-            cur = conn.cursor()
-            cur.execute("SELECT chat_id FROM users WHERE id = (SELECT user_id FROM vehicles WHERE id = ?)", (r["vehicle_id"],))
-            chat_id_row = cur.fetchone()
-            if not chat_id_row:
-                continue
-            chat_id = chat_id_row[0]
-        finally:
-            conn.close()
-        await h_rem.schedule_time_reminder_job(app, r["id"], r["vehicle_id"], r["due_at"], r["description"], chat_id)
-    # Pianifica job giornaliero per km (alle 09:00 locali)
-    tz = pytz.timezone(config.tz)
-    now_local = datetime.now(tz)
-    first_time = now_local.replace(hour=9, minute=0, second=0, microsecond=0)
-    if first_time < now_local:
-        from datetime import timedelta
-        first_time += timedelta(days=1)
-    app.job_queue.run_repeating(h_rem.km_checker_job, interval=86400, first=first_time, name="km_checker")
+    h_export.configure(config.export_workers)
+    notifications.configure(
+        app.bot, config.db_path,
+        workers=config.notify_workers, rate=config.notify_rate,
+        chat_rate=config.notify_chat_rate, max_retries=config.notify_max_retries,
+    )
+    await metrics.configure(app, config.metrics_port, config.metrics_listen)
+    # Promemoria e controllo km: li pianifica un solo processo, quello che tiene il lease
+    with startup.phase("promemoria"):
+        await leader.configure(
+            config.db_path,
+            on_acquire=functools.partial(_start_scheduling, app),
+            on_release=functools.partial(h_rem.stop_scheduling, app),
+            ttl=config.lease_ttl,
+        )
+    startup.log()
+
+async def post_shutdown(app):
+    await leader.shutdown()
+    await notifications.shutdown()
+    await metrics.shutdown()
+    profiling.shutdown()
+    h_export.shutdown()
+    astorage.shutdown()
 
 def main():
-    persistence = PicklePersistence(filepath="bot-data.pickle")
-    app = ApplicationBuilder().token(config.bot_token).persistence(persistence).post_init(post_init).build()
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    # httpx logga ogni chiamata getUpdates a livello INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    # Inizializza pool DB e DB (prima di build: la persistenza legge dal DB)
+    with startup.phase("db"):
+        if config.slow_query_ms > 0:
+            # prima di aprire connessioni: la soglia vale per quelle nuove
+            storage.set_slow_query_threshold(config.slow_query_ms / 1000)
+        storage.init_db(config.db_path)
+        astorage.configure(config.db_workers, config.db_queue_size)
+    persistence = SQLitePersistence(config.db_path, update_interval=config.persistence_interval)
+    builder = ApplicationBuilder().token(config.bot_token).persistence(persistence).post_init(post_init).post_shutdown(post_shutdown)
+    if config.bot_api_url:
+        builder = builder.base_url(config.bot_api_url)
+    if config.concurrent_updates > 1:
+        # update di chat diverse in parallelo; le conversazioni restano per utente
+        builder = builder.concurrent_updates(config.concurrent_updates)
+    app = builder.build()
 
-    # Handlers
-    for h in h_start.get_handlers(): app.add_handler(h)
-    for h in h_vehicles.get_handlers(): app.add_handler(h)
-    for h in h_maint.get_handlers(): app.add_handler(h)
-    for h in h_rem.get_handlers(): app.add_handler(h)
-    for h in h_export.get_handlers(): app.add_handler(h)
+    with startup.phase("handlers"):
+        # Handlers
+        for h in h_start.get_handlers(): app.add_handler(h)
+        for h in h_vehicles.get_handlers(): app.add_handler(h)
+        for h in h_maint.get_handlers(): app.add_handler(h)
+        for h in h_rem.get_handlers(): app.add_handler(h)
+        for h in h_export.get_handlers(): app.add_handler(h)
+        for h in h_stats.get_handlers(): app.add_handler(h)
+        for h in h_search.get_handlers(): app.add_handler(h)
+        for h in h_import.get_handlers(): app.add_handler(h)
 
-    # Router per pulsanti menu testuali
-    from app.handlers.vehicles import list_vehicles
-    from app.handlers.maintenance import history
-    app.add_handler(MessageHandler(filters.Regex("^🚗 Veicoli$"), list_vehicles))
-    app.add_handler(MessageHandler(filters.Regex("^🛠️ Manutenzione$"), history))
-    app.add_handler(MessageHandler(filters.Regex("^⏰ Promemoria$"), h_rem.set_time_reminder_start))
-    app.add_handler(MessageHandler(filters.Regex("^ℹ️ Aiuto$"), h_start.help_cmd))
+        # Router per pulsanti menu testuali
+        from app.handlers.vehicles import list_vehicles
+        from app.handlers.maintenance import history
+        app.add_handler(MessageHandler(filters.Regex("^🚗 Veicoli$"), list_vehicles))
+        app.add_handler(MessageHandler(filters.Regex("^🛠️ Manutenzione$"), history))
+        app.add_handler(MessageHandler(filters.Regex("^⏰ Promemoria$"), h_rem.set_time_reminder_start))
+        app.add_handler(MessageHandler(filters.Regex("^ℹ️ Aiuto$"), h_start.help_cmd))
+        for h in h_admin.get_handlers(config.admin_chat_ids): app.add_handler(h)
+        # timing ed errori di ogni callback registrata sopra
+        metrics.instrument_application(app)
+        profiling.configure(config.profile_sample, config.profile_chat_id or None, config.profile_dir)
 
-    print("Bot in esecuzione…")
-    app.run_polling(close_loop=False)
+    if config.mode == "webhook" and config.worker_id >= 0:
+        # worker di app.cluster: update dal router, il webhook l'ha registrato il router
+        from app import cluster
+        print(f"Worker {config.worker_id} in ascolto su {config.webhook_listen}:{config.webhook_port}/{config.webhook_path}…")
+        cluster.run_worker(app)
+    elif config.mode == "webhook":
+        # server HTTP integrato (tornado): le richieste senza il secret giusto ricevono 403
+        print(f"Bot in ascolto su {config.webhook_listen}:{config.webhook_port}/{config.webhook_path}…")
+        app.run_webhook(
+            listen=config.webhook_listen,
+            port=config.webhook_port,
+            url_path=config.webhook_path,
+            webhook_url=config.webhook_url,
+            secret_token=config.webhook_secret,
+            close_loop=False,
+        )
+    else:
+        print("Bot in esecuzione…")
+        app.run_polling(close_loop=False)
 
 if __name__ == "__main__":
     main()
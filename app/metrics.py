@@ -0,0 +1,307 @@
+"""
+Metriche del bot in formato testo Prometheus, senza dipendenze esterne.
+
+- handler: durata di ogni callback registrata in main() (anche dentro le
+  ConversationHandler) ed errori;
+- storage: durata ed errori di ogni funzione di app/storage.py che apre il DB;
+- persistenza: durata dei flush su DB;
+- promemoria: durata degli invii e contatori del dispatcher;
+- code, lette al momento dello scrape: job della JobQueue, notifiche in coda,
+  promemoria nella finestra dello scheduler, richieste DB in attesa.
+
+Lo stesso wrapper degli handler fa da aggancio per app/profiling.py.
+
+Esposte su http://METRICS_LISTEN:METRICS_PORT/metrics (se METRICS_PORT è
+impostata) e riassunte da /admin_stats per le chat in ADMIN_CHAT_IDS.
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+
+from app import astorage, leader, notifications, profiling, scheduler, storage
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "libretto_"
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(label: Optional[str], value: Optional[str], extra: str = "") -> str:
+    parts = [f'{label}="{_escape(value)}"'] if label else []
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        self.name, self.help, self.label = PREFIX + name, help, label
+        self._values: Dict[Optional[str], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value: Optional[str] = None, amount: float = 1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def values(self) -> Dict[Optional[str], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.label, v)} {n}" for v, n in sorted(self.values().items(), key=str)]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label: Optional[str] = None, buckets: Tuple[float, ...] = BUCKETS):
+        self.name, self.help, self.label, self.buckets = PREFIX + name, help, label, buckets
+        self._series: Dict[Optional[str], list] = {}  # label -> [conteggi per bucket..., +Inf, somma]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, label_value: Optional[str] = None):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += seconds
+
+    def snapshot(self) -> Dict[Optional[str], Tuple[List[int], float]]:
+        """label -> (conteggi per bucket non cumulativi, +Inf in fondo; somma)."""
+        with self._lock:
+            return {k: (list(v[:-1]), v[-1]) for k, v in self._series.items()}
+
+    def quantile(self, counts: List[int], q: float) -> float:
+        """Limite superiore del bucket che contiene il quantile q (inf se oltre l'ultimo)."""
+        target, seen = q * sum(counts), 0
+        for bound, n in zip((*self.buckets, float("inf")), counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, (counts, total) in sorted(self.snapshot().items(), key=lambda kv: str(kv[0])):
+            cumulative = 0
+            for bound, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label, value, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label, value)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.label, value)} {cumulative}")
+        return lines
+
+
+class Callback:
+    """Valore letto allo scrape: fn() ritorna un numero o un dict label -> numero."""
+
+    def __init__(self, name: str, help: str, fn: Callable, kind: str = "gauge", label: Optional[str] = None):
+        self.name, self.help, self.fn, self.kind, self.label = PREFIX + name, help, fn, kind, label
+
+    def render(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            logger.exception("Metrica %s non leggibile", self.name)
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        items = value.items() if isinstance(value, dict) else [(None, value)]
+        lines += [f"{self.name}{_labels(self.label, k)} {v}" for k, v in items]
+        return lines
+
+
+HANDLER_SECONDS = Histogram("handler_seconds", "Durata delle callback degli handler", "handler")
+HANDLER_ERRORS = Counter("handler_errors_total", "Eccezioni uscite dalle callback degli handler", "handler")
+STORAGE_SECONDS = Histogram("storage_seconds", "Durata delle funzioni di app/storage.py", "op")
+STORAGE_ERRORS = Counter("storage_errors_total", "Eccezioni delle funzioni di app/storage.py", "op")
+PERSISTENCE_FLUSH_SECONDS = Histogram("persistence_flush_seconds", "Durata dei flush della persistenza PTB su DB")
+REMINDER_SEND_SECONDS = Histogram("reminder_send_seconds", "Durata delle sendMessage dei promemoria")
+
+_started = time.time()
+_app = None
+_server: Optional[asyncio.AbstractServer] = None
+
+
+def _job_count() -> int:
+    return len(_app.job_queue.jobs()) if _app is not None and _app.job_queue else 0
+
+
+def _notify_stats() -> Dict[str, int]:
+    d = notifications.get_dispatcher()
+    return dict(d.stats) if d is not None else {}
+
+
+def _cache_stats(key: str) -> Dict[str, int]:
+    return {name: s[key] for name, s in storage.cache_stats().items()}
+
+
+REGISTRY = [
+    HANDLER_SECONDS, HANDLER_ERRORS, STORAGE_SECONDS, STORAGE_ERRORS, PERSISTENCE_FLUSH_SECONDS, REMINDER_SEND_SECONDS,
+    Callback("notifications_total", "Notifiche promemoria per esito", _notify_stats, "counter", "result"),
+    Callback("notify_queue", "Notifiche in coda al dispatcher",
+             lambda: d.queue_size if (d := notifications.get_dispatcher()) else 0),
+    Callback("scheduler_window", "Promemoria nella finestra in memoria dello scheduler",
+             lambda: len(s) if (s := scheduler.get_scheduler()) else 0),
+    Callback("jobqueue_jobs", "Job nella JobQueue", _job_count),
+    Callback("db_pending", "Richieste DB in volo o in attesa sul pool", astorage.pending),
+    Callback("cache_hits_total", "Hit delle cache di lettura di storage", lambda: _cache_stats("hits"), "counter", "cache"),
+    Callback("cache_misses_total", "Miss delle cache di lettura di storage", lambda: _cache_stats("misses"), "counter", "cache"),
+    Callback("slow_queries_total", "Statement SQL oltre la soglia SLOW_QUERY_MS",
+             lambda: sum(e["count"] for e in storage.slow_query_report()), "counter"),
+    Callback("leader", "1 se il processo tiene il lease dello scheduler", lambda: int(leader.is_leader())),
+    Callback("uptime_seconds", "Secondi dall'avvio del processo", lambda: round(time.time() - _started, 1)),
+]
+
+
+def render() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# --- strumentazione ---
+
+def _observe_storage(op: str, seconds: float, ok: bool):
+    STORAGE_SECONDS.observe(seconds, op)
+    if not ok:
+        STORAGE_ERRORS.inc(op)
+
+
+def _timed_callback(callback: Callable) -> Callable:
+    name = getattr(callback, "__name__", type(callback).__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        # a profilazione spenta costa solo questo controllo
+        profile = profiling.start(name, update) if profiling.active else None
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            if profile is not None:
+                profiling.stop(profile)
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+    wrapper._metrics_wrapped = True
+    return wrapper
+
+
+def _instrument_handler(handler):
+    if isinstance(handler, ConversationHandler):
+        for h in (*handler.entry_points, *(h for hs in handler.states.values() for h in hs), *handler.fallbacks):
+            _instrument_handler(h)
+        return
+    callback = getattr(handler, "callback", None)
+    if callback is not None and not getattr(callback, "_metrics_wrapped", False):
+        handler.callback = _timed_callback(callback)
+
+
+def instrument_application(app):
+    """Avvolge con il timing le callback di tutti gli handler già registrati."""
+    for group in app.handlers.values():
+        for handler in group:
+            _instrument_handler(handler)
+
+
+# --- esposizione ---
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+        path = request.split(b" ", 2)[1].split(b"?", 1)[0]
+        if path == b"/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, IndexError):
+        pass
+    finally:
+        writer.close()
+
+
+async def configure(app, port: int = 0, listen: str = "127.0.0.1"):
+    """Collega storage e application alle metriche; con port > 0 avvia l'endpoint HTTP."""
+    global _app, _server
+    _app = app
+    storage.set_observer(_observe_storage)
+    if port:
+        _server = await asyncio.start_server(_serve, listen, port)
+        logger.info("Metriche su http://%s:%d/metrics", listen, port)
+
+
+async def shutdown():
+    global _app, _server
+    storage.set_observer(None)
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
+    _app = None
+
+
+# --- riepilogo per /admin_stats ---
+
+def _ms(seconds: float) -> str:
+    return "∞" if seconds == float("inf") else f"{seconds * 1000:.0f}"
+
+
+def _top(hist: Histogram, errors: Counter, n: int, key) -> List[str]:
+    err = errors.values()
+    rows = []
+    for name, (counts, total) in hist.snapshot().items():
+        count = sum(counts)
+        rows.append((key(count, total), f"• {name}: {count}× media {_ms(total / count)} ms, "
+                                        f"p95 ≤{_ms(hist.quantile(counts, 0.95))} ms"
+                                        + (f", errori {int(err[name])}" if err.get(name) else "")))
+    return [line for _, line in sorted(rows, reverse=True)[:n]]
+
+
+def summary_text(top: int = 8) -> str:
+    uptime = int(time.time() - _started)
+    sent = _notify_stats()
+    flush_counts, flush_total = PERSISTENCE_FLUSH_SECONDS.snapshot().get(None, ([0], 0.0))
+    flushes = sum(flush_counts)
+    lines = [
+        f"📊 Stato del bot (attivo da {uptime // 3600}h{uptime % 3600 // 60:02d}m, "
+        f"{'leader' if leader.is_leader() else 'non leader'})",
+        "",
+        "Handler più chiamati:",
+        *(_top(HANDLER_SECONDS, HANDLER_ERRORS, top, lambda count, total: count) or ["• nessuna chiamata"]),
+        "",
+        "Storage, per tempo totale:",
+        *(_top(STORAGE_SECONDS, STORAGE_ERRORS, top, lambda count, total: total) or ["• nessuna chiamata"]),
+        "",
+        f"Code: JobQueue {_job_count()}, notifiche {notifications.get_dispatcher().queue_size if notifications.get_dispatcher() else 0}, "
+        f"finestra promemoria {len(scheduler.get_scheduler() or ())}, DB in attesa {astorage.pending()}",
+        f"Promemoria: inviati {sent.get('sent', 0)}, falliti {sent.get('failed', 0)}, ritentati {sent.get('retried', 0)}",
+        f"Persistenza: {flushes} flush" + (f", media {_ms(flush_total / flushes)} ms" if flushes else ""),
+    ]
+    slow = storage.slow_query_report()[:3]
+    if slow:
+        lines += ["", "Query lente, per tempo totale:"]
+        for e in slow:
+            statement = e["statement"] if len(e["statement"]) <= 90 else e["statement"][:89] + "…"
+            lines.append(f"• {e['count']}× max {_ms(e['max_s'])} ms: {statement}")
+            lines += [f"  {step}" for step in e["plan"]]
+    return "\n".join(lines)[:4096]
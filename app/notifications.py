@@ -0,0 +1,182 @@
+"""
+Invio delle notifiche dei promemoria.
+
+I messaggi finiscono in una coda asyncio servita da un pool di worker. Ogni invio
+rispetta due token bucket (globale e per chat, sui limiti di Telegram), viene
+ritentato con backoff su RetryAfter / errori di rete e il promemoria viene
+disattivato solo dopo un invio andato a buon fine.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Set
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from app import astorage, metrics
+
+logger = logging.getLogger(__name__)
+
+# Telegram: ~30 messaggi/s in totale, ~1 messaggio/s verso la stessa chat
+DEFAULT_RATE = 25.0
+DEFAULT_CHAT_RATE = 1.0
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+MAX_CHAT_BUCKETS = 10_000
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class Notification:
+    chat_id: int
+    text: str
+    reminder_id: Optional[int] = None
+
+
+def _retry_after_seconds(e: RetryAfter) -> float:
+    ra = e.retry_after
+    return ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+
+
+class Dispatcher:
+    def __init__(self, bot, db_path: str, workers: int = DEFAULT_WORKERS, rate: float = DEFAULT_RATE,
+                 chat_rate: float = DEFAULT_CHAT_RATE, max_retries: int = DEFAULT_MAX_RETRIES):
+        self.bot = bot
+        self.db_path = db_path
+        self.workers = workers
+        self.max_retries = max_retries
+        self.stats: Dict[str, int] = {"sent": 0, "failed": 0, "retried": 0}
+        self._queue: "asyncio.Queue[Notification]" = asyncio.Queue()
+        self._global = TokenBucket(rate)
+        self._chat_rate = chat_rate
+        self._chats: Dict[int, TokenBucket] = {}  # in ordine di ultimo uso
+        self._pending_reminders: Set[int] = set()
+        self._resume_at = 0.0  # dopo un RetryAfter tutti i worker aspettano fin qui
+        self._tasks: list = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker(), name=f"notify-{i}") for i in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        """Prova a svuotare la coda entro `timeout`, poi ferma i worker."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Dispatcher fermato con %d notifiche in coda", self._queue.qsize())
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, chat_id: int, text: str, reminder_id: Optional[int] = None) -> bool:
+        """Accoda una notifica. Un promemoria già in coda non viene accodato due volte."""
+        if reminder_id is not None:
+            if reminder_id in self._pending_reminders:
+                return False
+            self._pending_reminders.add(reminder_id)
+        self._queue.put_nowait(Notification(chat_id, text, reminder_id))
+        return True
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.pop(chat_id, None) or TokenBucket(self._chat_rate, capacity=1)
+        self._chats[chat_id] = bucket
+        if len(self._chats) > MAX_CHAT_BUCKETS:
+            del self._chats[next(iter(self._chats))]
+        return bucket
+
+    async def _worker(self):
+        while True:
+            n = await self._queue.get()
+            try:
+                await self._deliver(n)
+            except Exception:
+                logger.exception("Errore inatteso inviando a chat %s", n.chat_id)
+                self.stats["failed"] += 1
+            finally:
+                if n.reminder_id is not None:
+                    self._pending_reminders.discard(n.reminder_id)
+                self._queue.task_done()
+
+    async def _deliver(self, n: Notification):
+        for attempt in range(self.max_retries + 1):
+            await self._chat_bucket(n.chat_id).acquire()
+            await self._global.acquire()
+            pause = self._resume_at - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            started = time.perf_counter()
+            try:
+                await self.bot.send_message(chat_id=n.chat_id, text=n.text)
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                self._resume_at = max(self._resume_at, time.monotonic() + delay)
+            except (Forbidden, BadRequest):
+                # bot bloccato / chat inesistente: inutile ritentare, il promemoria resta attivo
+                logger.warning("Chat %s non raggiungibile, promemoria %s non inviato", n.chat_id, n.reminder_id)
+                break
+            except (TimedOut, NetworkError):
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)
+            else:
+                metrics.REMINDER_SEND_SECONDS.observe(time.perf_counter() - started)
+                self.stats["sent"] += 1
+                if n.reminder_id is not None:
+                    await astorage.deactivate_reminder(self.db_path, n.reminder_id)
+                return
+            if attempt < self.max_retries:
+                self.stats["retried"] += 1
+                await asyncio.sleep(delay)
+        self.stats["failed"] += 1
+
+
+_dispatcher: Optional[Dispatcher] = None
+
+
+def configure(bot, db_path: str, **kwargs) -> Dispatcher:
+    """Crea e avvia il dispatcher. Da chiamare in post_init (serve un event loop attivo)."""
+    global _dispatcher
+    _dispatcher = Dispatcher(bot, db_path, **kwargs)
+    _dispatcher.start()
+    return _dispatcher
+
+
+def get_dispatcher() -> Optional[Dispatcher]:
+    return _dispatcher
+
+
+async def shutdown():
+    global _dispatcher
+    if _dispatcher is not None:
+        await _dispatcher.stop()
+        _dispatcher = None
+
+
+def notify(chat_id: int, text: str, reminder_id: Optional[int] = None) -> bool:
+    if _dispatcher is None:
+        raise RuntimeError("Dispatcher notifiche non configurato")
+    return _dispatcher.submit(chat_id, text, reminder_id)
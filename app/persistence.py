@@ -0,0 +1,138 @@
+"""
+Persistenza PTB sullo stesso DB SQLite del bot, al posto di PicklePersistence.
+
+- una riga per chiave (user_data di un utente, chat_data di una chat, uno stato
+  di conversazione): si riscrive solo ciò che è cambiato, non l'intero file;
+- user_data e chat_data si caricano al primo update di quell'utente/chat
+  (refresh_*), non tutti all'avvio;
+- gli aggiornamenti di uno stesso giro di update_persistence finiscono in
+  un'unica transazione; dati identici all'ultima scrittura non si riscrivono.
+"""
+import asyncio
+import json
+import pickle
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from app import astorage, metrics
+
+
+def _dumps(data: Any) -> bytes:
+    return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, db_path: str, update_interval: float = 60, store_data: Optional[PersistenceInput] = None):
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.db_path = db_path
+        self._pending: Dict[Tuple[str, str], Optional[bytes]] = {}
+        self._written: Dict[Tuple[str, str], int] = {}  # hash dell'ultimo blob scritto/letto
+        self._flush_task: Optional[asyncio.Task] = None
+        self._loaded_users: Set[int] = set()
+        self._loaded_chats: Set[int] = set()
+
+    # --- scrittura a blocchi ---
+
+    def _stage(self, kind: str, key: str, data: Optional[bytes]):
+        digest = None if data is None else hash(data)
+        if digest is not None and self._written.get((kind, key)) == digest:
+            return
+        self._pending[(kind, key)] = data
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        # lascia accodare tutte le update_* dello stesso giro prima di scrivere
+        await asyncio.sleep(0)
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            started = time.perf_counter()
+            try:
+                await astorage.save_persistence(self.db_path, [(kind, key, data) for (kind, key), data in batch.items()])
+                metrics.PERSISTENCE_FLUSH_SECONDS.observe(time.perf_counter() - started)
+            except BaseException:
+                self._pending = {**batch, **self._pending}
+                raise
+            for k, data in batch.items():
+                if data is None:
+                    self._written.pop(k, None)
+                else:
+                    self._written[k] = hash(data)
+
+    async def _load(self, kind: str, key: str) -> Optional[Any]:
+        blob = await astorage.load_persistence(self.db_path, kind, key)
+        if blob is None:
+            return None
+        self._written[(kind, key)] = hash(blob)
+        return pickle.loads(blob)
+
+    # --- get (all'avvio) ---
+
+    async def get_user_data(self) -> Dict[int, Any]:
+        return {}  # caricati uno a uno in refresh_user_data
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}  # caricati uno a uno in refresh_chat_data
+
+    async def get_bot_data(self) -> Any:
+        return await self._load("bot", "") or {}
+
+    async def get_callback_data(self) -> Optional[Any]:
+        return await self._load("callback", "")
+
+    async def get_conversations(self, name: str) -> Dict:
+        # solo conversazioni in corso: quelle terminate vengono cancellate
+        rows = await astorage.load_persistence_kind(self.db_path, f"conv:{name}")
+        return {tuple(json.loads(r["key"])): pickle.loads(r["data"]) for r in rows}
+
+    # --- refresh (prima di ogni update) ---
+
+    async def refresh_user_data(self, user_id: int, user_data: Any) -> None:
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        stored = await self._load("user", str(user_id))
+        if stored:
+            user_data.update(stored)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        if chat_id in self._loaded_chats:
+            return
+        self._loaded_chats.add(chat_id)
+        stored = await self._load("chat", str(chat_id))
+        if stored:
+            chat_data.update(stored)
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        pass  # bot_data vive in memoria, caricato all'avvio
+
+    # --- update ---
+
+    async def update_user_data(self, user_id: int, data: Any) -> None:
+        self._stage("user", str(user_id), _dumps(data))
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        self._stage("chat", str(chat_id), _dumps(data))
+
+    async def update_bot_data(self, data: Any) -> None:
+        self._stage("bot", "", _dumps(data))
+
+    async def update_callback_data(self, data: Any) -> None:
+        self._stage("callback", "", _dumps(data))
+
+    async def update_conversation(self, name: str, key: Tuple[int | str, ...], new_state: Optional[object]) -> None:
+        self._stage(f"conv:{name}", json.dumps(list(key)), None if new_state is None else _dumps(new_state))
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage("user", str(user_id), None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._stage("chat", str(chat_id), None)
+
+    async def flush(self) -> None:
+        if self._flush_task is not None:
+            await self._flush_task
+        if self._pending:
+            await self._write_pending()
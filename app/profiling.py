@@ -0,0 +1,105 @@
+"""
+Profilazione a campione degli update, per capire dove va il tempo dentro un
+handler (parsing delle date, tastiere, SQLite, rete).
+
+Spenta di default e senza costo: il wrapper degli handler in app/metrics.py
+controlla solo `active`. Accesa (PROFILE_SAMPLE o /admin_profile) profila con
+cProfile una frazione degli update, eventualmente di una sola chat, e accumula
+un profilo per handler; dump() li scrive in PROFILE_DIR come <handler>.prof,
+in formato pstats (python -m pstats, snakeviz, ...).
+
+cProfile misura solo il thread dell'event loop: mentre l'handler aspetta, il
+tempo va al select del loop (rete e pool DB) e agli altri task che girano nel
+frattempo. Le query SQLite girano sui thread del pool DB e qui si vedono come
+attesa; il dettaglio per funzione è nelle metriche di storage. Si profila un
+update alla volta: con CONCURRENT_UPDATES > 1 conviene limitarsi a una chat.
+"""
+import cProfile
+import logging
+import os
+import random
+import re
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+active = False
+_rate = 0.0
+_chat_id: Optional[int] = None
+_dir = "./data/profiles"
+_profiles: Dict[str, cProfile.Profile] = {}
+_samples: Dict[str, int] = {}
+_busy = False  # un solo profiler alla volta per thread
+
+
+def configure(rate: float, chat_id: Optional[int] = None, directory: Optional[str] = None):
+    """Accende (rate > 0) o spegne la profilazione; i profili già raccolti restano."""
+    global active, _rate, _chat_id, _dir
+    _rate = max(0.0, min(1.0, rate))
+    _chat_id = chat_id
+    if directory:
+        _dir = directory
+    active = _rate > 0
+
+
+def start(name: str, update) -> Optional[cProfile.Profile]:
+    """Se l'update è campionato accende il profilo dell'handler e lo ritorna."""
+    global _busy
+    if _busy or random.random() >= _rate:
+        return None
+    if _chat_id is not None:
+        chat = getattr(update, "effective_chat", None)
+        if chat is None or chat.id != _chat_id:
+            return None
+    profile = _profiles.get(name)
+    if profile is None:
+        profile = _profiles[name] = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # da Python 3.12: c'è già un altro profiler attivo nel processo
+        return None
+    _busy = True
+    _samples[name] = _samples.get(name, 0) + 1
+    return profile
+
+
+def stop(profile: cProfile.Profile):
+    global _busy
+    profile.disable()
+    _busy = False
+
+
+def dump() -> List[str]:
+    """Scrive i profili accumulati, uno per handler, e ritorna i percorsi."""
+    os.makedirs(_dir, exist_ok=True)
+    paths = []
+    for name, profile in list(_profiles.items()):
+        path = os.path.join(_dir, re.sub(r"[^\w.-]", "_", name) + ".prof")
+        profile.dump_stats(path)
+        paths.append(path)
+    return paths
+
+
+def reset():
+    _profiles.clear()
+    _samples.clear()
+
+
+def status_text() -> str:
+    if active:
+        head = f"🔬 Profilazione attiva: {_rate:.0%} degli update" + (f", solo chat {_chat_id}" if _chat_id else "")
+    else:
+        head = "🔬 Profilazione spenta"
+    lines = [head, f"Cartella: {_dir}"]
+    for name, n in sorted(_samples.items(), key=lambda item: item[1], reverse=True):
+        lines.append(f"• {name}: {n} campioni")
+    return "\n".join(lines)[:4096]
+
+
+def shutdown():
+    global active
+    active = False
+    if _profiles:
+        paths = dump()
+        logger.info("Profili scritti in %s (%d handler)", _dir, len(paths))
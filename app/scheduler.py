@@ -0,0 +1,194 @@
+"""
+Scheduler dei promemoria a data/ora guidato dal DB.
+
+In memoria c'è solo una finestra: i promemoria attivi che scadono entro
+`horizon` secondi, letti dall'indice parziale su reminders(due_at, id). Un solo
+task dorme fino alla prossima scadenza, invia i promemoria scaduti a blocchi e
+ricarica la finestra quando si accorcia. La memoria cresce con i promemoria in
+scadenza a breve, non con tutti quelli attivi.
+
+La finestra copre tutte le chiavi (due_at, id) fino a `_bound`: le ricariche
+leggono solo oltre `_bound`, quindi un promemoria già inviato (o in coda al
+dispatcher) non viene riletto. I promemoria creati dopo con chiave entro
+`_bound` entrano con add(); gli altri li trova una ricarica successiva.
+
+Gira solo nel processo che tiene il lease (vedi handlers/reminders.py).
+"""
+import asyncio
+import heapq
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import pytz
+
+from app import astorage, notifications
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HORIZON = 3600.0
+DEFAULT_MAX_WINDOW = 10_000
+FIRE_BATCH = 500
+# "YYYY-MM-DD HH:MM:SS": si confronta come stringa con due_at ("YYYY-MM-DD HH:MM[:SS]")
+KEY_FORMAT = "%Y-%m-%d %H:%M:%S"
+_MAX_ID = 2 ** 63 - 1
+
+Entry = Tuple[str, int, int, int, str]  # due_at, id, chat_id, vehicle_id, description
+
+
+class ReminderScheduler:
+    def __init__(self, db_path: str, tz: str, horizon: float = DEFAULT_HORIZON,
+                 max_window: int = DEFAULT_MAX_WINDOW):
+        self.db_path = db_path
+        self.tz = pytz.timezone(tz)
+        self.horizon = horizon
+        self.max_window = max_window
+        self._heap: List[Entry] = []
+        self._ids = set()  # id nella finestra: add() e pickup non li duplicano
+        self._bound: Tuple[str, int] = ("", 0)
+        self._refill_until: Optional[str] = None  # limite della ricarica in corso
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.fired = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _now(self) -> datetime:
+        return datetime.now(self.tz)
+
+    def _seconds_until(self, due_at: str) -> float:
+        try:
+            dt = datetime.fromisoformat(due_at)
+        except ValueError:
+            return 0.0  # due_at illeggibile: meglio inviarlo subito che mai
+        if dt.tzinfo is None:
+            dt = self.tz.localize(dt)
+        return (dt - self._now()).total_seconds()
+
+    async def start(self):
+        """Prima finestra subito (i promemoria già scaduti partono all'avvio), poi il loop."""
+        await self.refill()
+        self._task = asyncio.create_task(self._loop(), name="reminder-scheduler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._heap.clear()
+        self._ids.clear()
+
+    def _push(self, entry: Entry):
+        if entry[1] not in self._ids:
+            self._ids.add(entry[1])
+            heapq.heappush(self._heap, entry)
+
+    def add(self, reminder_id: int, due_at: str, chat_id: int, vehicle_id: int, description: str) -> bool:
+        """Promemoria appena creato: entra nella finestra se ci cade dentro. Ritorna True se aggiunto."""
+        key = (due_at, reminder_id)
+        # durante una ricarica la query può aver già letto oltre _bound senza vederlo
+        in_refill = self._refill_until is not None and due_at <= self._refill_until
+        if key > self._bound and not in_refill:
+            return False  # lo leggerà una ricarica successiva
+        self._push((due_at, reminder_id, chat_id, vehicle_id, description))
+        self._wake.set()
+        return True
+
+    async def refill(self) -> int:
+        """Estende la finestra fino a now + horizon (al massimo max_window promemoria in memoria)."""
+        until = datetime.fromtimestamp(self._now().timestamp() + self.horizon, self.tz).strftime(KEY_FORMAT)
+        loaded = 0
+        self._refill_until = until
+        try:
+            while len(self._heap) < self.max_window:
+                limit = min(FIRE_BATCH, self.max_window - len(self._heap))
+                rows = await astorage.list_time_reminders_window(self.db_path, self._bound, until, limit)
+                for r in rows:
+                    self._push((r["due_at"], r["id"], r["chat_id"], r["vehicle_id"], r["description"]))
+                loaded += len(rows)
+                if rows:
+                    self._bound = (rows[-1]["due_at"], rows[-1]["id"])
+                if len(rows) < limit:
+                    # letto tutto fino a `until`: la finestra lo copre per intero
+                    self._bound = max(self._bound, (until, _MAX_ID))
+                    break
+        finally:
+            self._refill_until = None
+        return loaded
+
+    async def fire_due(self) -> int:
+        """Invia a blocchi i promemoria scaduti, saltando quelli disattivati nel frattempo."""
+        now = self._now().strftime(KEY_FORMAT)
+        sent = 0
+        while self._heap and self._heap[0][0] <= now:
+            batch = []
+            while self._heap and self._heap[0][0] <= now and len(batch) < FIRE_BATCH:
+                batch.append(heapq.heappop(self._heap))
+                self._ids.discard(batch[-1][1])
+            active = await astorage.filter_active_reminders(self.db_path, [e[1] for e in batch])
+            for due_at, rid, chat_id, vehicle_id, description in batch:
+                if rid in active:
+                    # il dispatcher disattiva il promemoria solo a invio riuscito
+                    notifications.notify(chat_id, f"⏰ Promemoria: {description} (veicolo ID {vehicle_id})", rid)
+                    sent += 1
+        self.fired += sent
+        return sent
+
+    def _sleep_time(self) -> float:
+        # ricarica quando metà dell'orizzonte è passata (o la finestra piena si è svuotata a metà)
+        bound_in = self._seconds_until(self._bound[0]) if self._bound[0] else 0.0
+        refill_in = bound_in - self.horizon / 2
+        if len(self._heap) >= self.max_window // 2:
+            refill_in = self.horizon / 2
+        next_due = self._seconds_until(self._heap[0][0]) if self._heap else self.horizon
+        return max(0.0, min(next_due, refill_in, self.horizon / 2))
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.fire_due()
+                if len(self._heap) < self.max_window // 2 and \
+                        self._seconds_until(self._bound[0]) < self.horizon / 2:
+                    await self.refill()
+                    continue  # la ricarica può portare promemoria già scaduti
+                delay = self._sleep_time()
+            except Exception:
+                logger.exception("Errore nello scheduler dei promemoria")
+                delay = 5.0
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+_scheduler: Optional[ReminderScheduler] = None
+
+
+async def configure(db_path: str, tz: str, horizon: float = DEFAULT_HORIZON,
+                    max_window: int = DEFAULT_MAX_WINDOW) -> ReminderScheduler:
+    """Avvia lo scheduler (il processo è diventato leader)."""
+    global _scheduler
+    await shutdown()
+    _scheduler = ReminderScheduler(db_path, tz, horizon, max_window)
+    await _scheduler.start()
+    return _scheduler
+
+
+def get_scheduler() -> Optional[ReminderScheduler]:
+    return _scheduler
+
+
+def add(reminder_id: int, due_at: str, chat_id: int, vehicle_id: int, description: str) -> bool:
+    # nessuno scheduler: il processo non è leader, il promemoria lo trova chi lo è
+    if _scheduler is None:
+        return False
+    return _scheduler.add(reminder_id, due_at, chat_id, vehicle_id, description)
+
+
+async def shutdown():
+    global _scheduler
+    if _scheduler is not None:
+        await _scheduler.stop()
+        _scheduler = None
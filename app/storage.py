@@ -1,17 +1,246 @@
 
+import functools
+import inspect
+import itertools
+import logging
 import sqlite3
-from contextlib import closing
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator, Tuple, Callable
 from datetime import datetime
 
-def _connect(db_path: str):
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    with closing(conn.cursor()) as cur:
-        cur.execute("PRAGMA foreign_keys = ON;")
+logger = logging.getLogger(__name__)
+
+# Connessioni: una per (thread, db_path), aperte alla prima richiesta e tenute
+# vive per tutta la vita del processo. Ogni thread del pool DB ha quindi la sua
+# connessione già configurata e la cache degli statement preparati già calda.
+PRAGMAS = (
+    "PRAGMA foreign_keys = ON;",
+    "PRAGMA journal_mode = WAL;",       # i lettori non aspettano lo scrittore
+    "PRAGMA synchronous = NORMAL;",     # sicuro in WAL, molte meno fsync
+    "PRAGMA cache_size = -16000;",      # ~16 MB di page cache per connessione
+    "PRAGMA mmap_size = 134217728;",    # 128 MB mappati in memoria
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA busy_timeout = 5000;",
+)
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_all_conns: List[sqlite3.Connection] = []
+_all_conns_lock = threading.Lock()
+_generation = 0  # incrementato da close_all(): invalida le connessioni dei thread
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    conns = getattr(_local, "conns", None)
+    if conns is None or _local.generation != _generation:
+        conns = _local.conns = {}
+        _local.generation = _generation
+    conn = conns.get(db_path)
+    if conn is None:
+        # check_same_thread=False solo per poterle chiudere da close_all():
+        # ogni connessione viene usata esclusivamente dal thread che l'ha aperta.
+        conn = sqlite3.connect(db_path, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False,
+                               factory=sqlite3.Connection if _slow_threshold is None else _TracedConnection)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conns[db_path] = conn
+        with _all_conns_lock:
+            _all_conns.append(conn)
     return conn
 
+@contextmanager
+def _db(db_path: str):
+    """Connessione del thread corrente; in caso di errore annulla la transazione aperta."""
+    conn = _connect(db_path)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+
+def close_all():
+    """Chiude tutte le connessioni aperte (allo shutdown, a pool DB fermo)."""
+    global _generation
+    with _all_conns_lock:
+        _generation += 1
+        for conn in _all_conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _all_conns.clear()
+
+# Log delle query lente. Con una soglia impostata le connessioni nuove nascono
+# come _TracedConnection: ogni statement viene cronometrato (execute più i fetch
+# delle righe, non il lavoro del chiamante tra un fetch e l'altro) e quelli sopra
+# soglia finiscono nel log e in un riepilogo per statement, con l'EXPLAIN QUERY
+# PLAN catturato la prima volta. Senza soglia le connessioni sono quelle normali.
+_slow_threshold: Optional[float] = None
+_slow_stats: Dict[str, Dict[str, Any]] = {}
+_slow_lock = threading.Lock()
+_EXPLAINABLE = {"SELECT", "WITH", "INSERT", "REPLACE", "UPDATE", "DELETE"}
+SLOW_LOG_INTERVAL = 60  # secondi tra due righe di log dello stesso statement
+
+def set_slow_query_threshold(seconds: Optional[float]):
+    """Soglia del log delle query lente (None = spento). Vale per le connessioni aperte da qui in poi."""
+    global _slow_threshold
+    _slow_threshold = seconds
+
+def slow_query_report() -> List[Dict[str, Any]]:
+    """Statement sopra soglia dall'avvio, dal più costoso in tempo totale."""
+    keys = ("statement", "count", "total_s", "max_s", "max_rows", "plan")
+    with _slow_lock:
+        entries = [{k: e[k] for k in keys} for e in _slow_stats.values()]
+    return sorted(entries, key=lambda e: e["total_s"], reverse=True)
+
+def _params_shape(params) -> str:
+    # solo i tipi: i valori sono dati degli utenti e nel log non servono
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in params.items()) + "}"
+    return "(" + ", ".join(type(v).__name__ for v in params) + ")"
+
+def _explain(conn: sqlite3.Connection, sql: str, params) -> List[str]:
+    words = sql.split(None, 1)
+    if not words or words[0].upper() not in _EXPLAINABLE:
+        return []
+    try:
+        # cursore normale: l'EXPLAIN non deve finire a sua volta nel log
+        rows = sqlite3.Cursor(conn).execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error as e:
+        return [f"EXPLAIN non riuscito: {e}"]
+    depth = {0: -1}
+    plan = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[node] + detail)
+    return plan
+
+def _record_slow(conn: sqlite3.Connection, sql: str, params, elapsed: float, rows: int):
+    statement = " ".join(sql.split())
+    with _slow_lock:
+        entry = _slow_stats.get(statement)
+        if entry is None:
+            entry = _slow_stats[statement] = {"statement": statement, "count": 0, "total_s": 0.0,
+                                              "max_s": 0.0, "max_rows": 0, "plan": None,
+                                              "logged_at": float("-inf"), "logged_count": 0}
+        entry["count"] += 1
+        entry["total_s"] += elapsed
+        entry["max_s"] = max(entry["max_s"], elapsed)
+        entry["max_rows"] = max(entry["max_rows"], rows)
+        plan = entry["plan"]
+        # una riga di log per statement ogni SLOW_LOG_INTERVAL: il riepilogo conta comunque tutto
+        now = time.monotonic()
+        if now - entry["logged_at"] < SLOW_LOG_INTERVAL:
+            return
+        since = entry["count"] - entry["logged_count"] - 1
+        entry["logged_at"], entry["logged_count"] = now, entry["count"]
+    if plan is None:
+        plan = _explain(conn, sql, params)
+        with _slow_lock:
+            entry["plan"] = plan
+    logger.warning("Query lenta: %.1f ms, %d righe, parametri %s%s: %s | piano: %s",
+                   elapsed * 1000, rows, _params_shape(params), f" (+{since} dall'ultimo avviso)" if since else "",
+                   statement, " / ".join(p.strip() for p in plan) or "n/d")
+
+class _TracedCursor(sqlite3.Cursor):
+    """Cursore che misura il proprio statement e lo registra quando è finito:
+    righe esaurite, nuovo execute, close o cursore raccolto."""
+    _sql: Optional[str] = None
+    _params: Any = ()
+    _elapsed = 0.0
+    _rows = 0
+
+    def _begin(self, sql: str, params):
+        self._finish()
+        self._sql, self._params, self._elapsed, self._rows = sql, params, 0.0, 0
+
+    def _finish(self):
+        sql, self._sql = self._sql, None
+        if sql is not None and _slow_threshold is not None and self._elapsed >= _slow_threshold:
+            _record_slow(self.connection, sql, self._params, self._elapsed, self._rows)
+
+    def _run(self, method, sql: str, params):
+        started = time.perf_counter()
+        try:
+            method(sql, params)
+        except BaseException:
+            self._sql = None
+            raise
+        self._elapsed += time.perf_counter() - started
+        if self.description is None:
+            # niente righe da leggere (INSERT/UPDATE/DELETE): lo statement è già finito
+            self._rows = max(self.rowcount, 0)
+            self._finish()
+        return self
+
+    def execute(self, sql, params=()):
+        self._begin(sql, params)
+        return self._run(super().execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        # per l'EXPLAIN basta la prima riga di parametri
+        it = iter(seq_of_params)
+        first = next(it, None)
+        self._begin(sql, () if first is None else first)
+        return self._run(super().executemany, sql, [] if first is None else itertools.chain([first], it))
+
+    def _fetched(self, started: float, n: int, done: bool):
+        self._elapsed += time.perf_counter() - started
+        self._rows += n
+        if done:
+            self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0, True)
+            raise
+        self._fetched(started, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # conn.execute(...).fetchone(): il cursore sparisce dopo la prima riga
+        self._finish()
+
+class _TracedConnection(sqlite3.Connection):
+    # Connection.execute in C crea un Cursor normale: vanno ridefiniti tutti e tre
+    def cursor(self, factory=_TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
 SCHEMA = [
     '''
     CREATE TABLE IF NOT EXISTS users (
@@ -73,31 +302,303 @@ SCHEMA = [
     '''
 ]
 
+# Riepilogo per veicolo (vehicle_summary) e per tipo di intervento (vehicle_type_summary):
+# add_maintenance li aggiorna nella stessa transazione dell'INSERT, così /stats legge
+# una riga per veicolo invece di scorrere tutti gli interventi. {where} filtra i veicoli
+# da ricalcolare ("" = tutti); a ogni `?` corrisponde un parametro.
+SUMMARY_REBUILD = [
+    "DELETE FROM vehicle_summary {where}",
+    """INSERT INTO vehicle_summary (vehicle_id, count, total_cost, last_date, last_km, first_km)
+       SELECT vehicle_id, COUNT(*), COALESCE(SUM(cost), 0), MAX(date),
+              (SELECT m2.km FROM maintenance m2 WHERE m2.vehicle_id = m.vehicle_id ORDER BY m2.date DESC, m2.id DESC LIMIT 1),
+              MIN(km)
+       FROM maintenance m {where} GROUP BY vehicle_id""",
+    "DELETE FROM vehicle_type_summary {where}",
+    """INSERT INTO vehicle_type_summary (vehicle_id, type, count, total_cost)
+       SELECT vehicle_id, type, COUNT(*), COALESCE(SUM(cost), 0)
+       FROM maintenance {where} GROUP BY vehicle_id, type""",
+]
+
+# Ricerca full-text sugli interventi: una riga FTS per intervento (rowid = maintenance.id).
+# owner ("u<user_id>") limita la ricerca ai veicoli dell'utente dentro FTS stesso;
+# vehicle contiene alias e targa normalizzata come clean_plate (maiuscolo, solo A-Z0-9).
+_FTS_PLATE = "upper(replace(replace(replace(replace(COALESCE(v.plate, ''), ' ', ''), '-', ''), '.', ''), '/', ''))"
+_FTS_VEHICLE = f"COALESCE(v.alias, '') || ' ' || {_FTS_PLATE}"
+
+# Migrazioni versionate: (versione, [statement]). init_db applica in ordine
+# quelle con versione > PRAGMA user_version, ognuna in una sua transazione.
+# Non modificare migrazioni già rilasciate: aggiungerne di nuove in coda.
+MIGRATIONS = [
+    (1, [
+        # list_vehicles: WHERE user_id = ? ORDER BY created_at DESC
+        "CREATE INDEX IF NOT EXISTS idx_vehicles_user_created ON vehicles(user_id, created_at)",
+        # list_maintenance: WHERE vehicle_id = ? ORDER BY date DESC, id DESC (id = rowid, già in coda all'indice)
+        "CREATE INDEX IF NOT EXISTS idx_maintenance_vehicle_date ON maintenance(vehicle_id, date)",
+        # list_active_*_reminders: WHERE kind = ? AND active = 1 (parziale: solo i promemoria attivi)
+        "CREATE INDEX IF NOT EXISTS idx_reminders_active_kind ON reminders(kind, vehicle_id) WHERE active = 1",
+        # export e ON DELETE CASCADE da vehicles
+        "CREATE INDEX IF NOT EXISTS idx_reminders_vehicle ON reminders(vehicle_id)",
+    ]),
+    (2, [
+        # rehydration a blocchi: WHERE kind = ? AND active = 1 AND id > ? ORDER BY id
+        "CREATE INDEX IF NOT EXISTS idx_reminders_active_kind_id ON reminders(kind, id) WHERE active = 1",
+    ]),
+    (3, [
+        # list_crossed_km_reminders: soglie superate da un nuovo chilometraggio
+        "CREATE INDEX IF NOT EXISTS idx_reminders_km_threshold ON reminders(vehicle_id, km_threshold) WHERE kind = 'km' AND active = 1",
+    ]),
+    (4, [
+        # versione dei dati esportabili di ogni utente: cresce a ogni scrittura
+        # su veicoli, interventi e promemoria (serve a riusare l'ultimo export)
+        "ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0",
+        *[
+            f"""CREATE TRIGGER IF NOT EXISTS trg_vehicles_{op.lower()}_version AFTER {op} ON vehicles BEGIN
+                UPDATE users SET data_version = data_version + 1 WHERE id = {row}.user_id;
+            END"""
+            for op, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD"))
+        ],
+        *[
+            f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_version AFTER {op} ON {table} BEGIN
+                UPDATE users SET data_version = data_version + 1
+                WHERE id = (SELECT user_id FROM vehicles WHERE id = {row}.vehicle_id);
+            END"""
+            for table in ("maintenance", "reminders")
+            for op, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD"))
+        ],
+    ]),
+    (5, [
+        # stato di PTB (user_data, chat_data, bot_data, conversazioni): una riga per chiave
+        """CREATE TABLE IF NOT EXISTS persistence (
+            kind TEXT NOT NULL,   -- 'user' | 'chat' | 'bot' | 'callback' | 'conv:<nome>'
+            key TEXT NOT NULL,
+            data BLOB NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID""",
+    ]),
+    (6, [
+        # riepiloghi per /stats, cancellati a cascata con il veicolo
+        """CREATE TABLE IF NOT EXISTS vehicle_summary (
+            vehicle_id INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0,
+            total_cost REAL NOT NULL DEFAULT 0,
+            last_date TEXT,       -- intervento più recente (date, id)
+            last_km INTEGER,      -- km di quell'intervento
+            first_km INTEGER,     -- km più bassi registrati in un intervento
+            FOREIGN KEY(vehicle_id) REFERENCES vehicles(id) ON DELETE CASCADE
+        )""",
+        """CREATE TABLE IF NOT EXISTS vehicle_type_summary (
+            vehicle_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            total_cost REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (vehicle_id, type),
+            FOREIGN KEY(vehicle_id) REFERENCES vehicles(id) ON DELETE CASCADE
+        ) WITHOUT ROWID""",
+        # backfill dagli interventi già presenti
+        *[stmt.format(where="") for stmt in SUMMARY_REBUILD],
+    ]),
+    (7, [
+        # /search: tokenizer senza accenti, indici di prefisso per le ricerche "parola*"
+        """CREATE VIRTUAL TABLE IF NOT EXISTS maintenance_fts USING fts5(
+            owner, vehicle, type, notes,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_maintenance_insert_fts AFTER INSERT ON maintenance BEGIN
+            INSERT INTO maintenance_fts (rowid, owner, vehicle, type, notes)
+            SELECT NEW.id, 'u' || v.user_id, {_FTS_VEHICLE}, NEW.type, COALESCE(NEW.notes, '')
+            FROM vehicles v WHERE v.id = NEW.vehicle_id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_maintenance_update_fts AFTER UPDATE ON maintenance BEGIN
+            DELETE FROM maintenance_fts WHERE rowid = OLD.id;
+            INSERT INTO maintenance_fts (rowid, owner, vehicle, type, notes)
+            SELECT NEW.id, 'u' || v.user_id, {_FTS_VEHICLE}, NEW.type, COALESCE(NEW.notes, '')
+            FROM vehicles v WHERE v.id = NEW.vehicle_id;
+        END""",
+        # scatta anche per le cancellazioni a cascata da vehicles
+        """CREATE TRIGGER IF NOT EXISTS trg_maintenance_delete_fts AFTER DELETE ON maintenance BEGIN
+            DELETE FROM maintenance_fts WHERE rowid = OLD.id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS trg_vehicles_rename_fts AFTER UPDATE OF alias, plate ON vehicles BEGIN
+            UPDATE maintenance_fts SET vehicle = (SELECT {_FTS_VEHICLE} FROM vehicles v WHERE v.id = NEW.id)
+            WHERE rowid IN (SELECT id FROM maintenance WHERE vehicle_id = NEW.id);
+        END""",
+        # backfill
+        f"""INSERT INTO maintenance_fts (rowid, owner, vehicle, type, notes)
+            SELECT m.id, 'u' || v.user_id, {_FTS_VEHICLE}, m.type, COALESCE(m.notes, '')
+            FROM maintenance m JOIN vehicles v ON v.id = m.vehicle_id""",
+    ]),
+    (8, [
+        # lease fra processi (es. chi pianifica i promemoria): scade se non rinnovato
+        """CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL  -- epoch in secondi
+        ) WITHOUT ROWID""",
+    ]),
+    (9, [
+        # scheduler dei promemoria (app/scheduler.py): finestra WHERE (due_at, id) > ? AND due_at <= ?
+        "CREATE INDEX IF NOT EXISTS idx_reminders_time_due ON reminders(due_at, id) WHERE kind = 'time' AND active = 1",
+    ]),
+]
+
+def _migrate(conn):
+    for version, stmts in MIGRATIONS:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+            continue
+        # BEGIN IMMEDIATE: se più processi partono insieme, uno solo applica la migrazione
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                conn.rollback()
+                continue
+            for stmt in stmts:
+                conn.execute(stmt)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
 def init_db(db_path: str):
     Path(db_path).parent.mkdir(parents=True, exist_ok=True)
-    conn = _connect(db_path)
-    with closing(conn):
+    with _db(db_path) as conn:
         cur = conn.cursor()
         for stmt in SCHEMA:
             cur.execute(stmt)
         conn.commit()
+        _migrate(conn)
+
+class _LRUCache:
+    """Dizionario thread-safe con capienza massima (scarta la voce usata meno di recente),
+    scadenza opzionale delle voci e contatori hit/miss."""
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()  # key -> (value, scadenza)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or (item[1] is not None and item[1] < time.monotonic()):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
 
-def ensure_user(conn, chat_id: int) -> int:
+# chat_id -> user_id: la mappatura non cambia finché l'utente esiste,
+# quindi si invalida solo in delete_user().
+USER_CACHE_SIZE = 10_000
+_user_ids = _LRUCache(USER_CACHE_SIZE)
+
+# Cache di lettura per utente (lista veicoli, tipi intervento): le scritture che
+# le riguardano le invalidano subito, la scadenza copre modifiche fatte da altri processi.
+READ_CACHE_SIZE = 10_000
+READ_CACHE_TTL = 300
+_vehicles_cache = _LRUCache(READ_CACHE_SIZE, ttl=READ_CACHE_TTL)
+_types_cache = _LRUCache(READ_CACHE_SIZE, ttl=READ_CACHE_TTL)
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    return {"user_ids": _user_ids.stats(), "vehicles": _vehicles_cache.stats(), "types": _types_cache.stats()}
+
+def _vehicle_owner(conn, vehicle_id: int) -> Optional[int]:
     cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE chat_id = ?", (chat_id,))
+    cur.execute("SELECT user_id FROM vehicles WHERE id = ?", (vehicle_id,))
     row = cur.fetchone()
-    if row:
-        return row["id"]
+    return row["user_id"] if row else None
+
+def lookup_user(conn, db_path: str, chat_id: int) -> Optional[int]:
+    """Risolve chat_id -> user_id senza scrivere nulla: None se l'utente non esiste."""
+    key = (db_path, chat_id)
+    user_id = _user_ids.get(key)
+    if user_id is None:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM users WHERE chat_id = ?", (chat_id,))
+        row = cur.fetchone()
+        if not row:
+            return None
+        user_id = row["id"]
+        _user_ids.put(key, user_id)
+    return user_id
+
+def ensure_user(conn, db_path: str, chat_id: int) -> int:
+    """Come lookup_user, ma crea l'utente se manca. Solo per i percorsi di scrittura."""
+    user_id = lookup_user(conn, db_path, chat_id)
+    if user_id is not None:
+        return user_id
     now = datetime.utcnow().isoformat()
-    cur.execute("INSERT INTO users (chat_id, created_at) VALUES (?,?)", (chat_id, now))
+    cur = conn.cursor()
+    cur.execute("INSERT OR IGNORE INTO users (chat_id, created_at) VALUES (?,?)", (chat_id, now))
     conn.commit()
-    return cur.lastrowid
+    return lookup_user(conn, db_path, chat_id)
+
+def get_user_data_version(db_path: str, chat_id: int) -> Optional[int]:
+    """Versione corrente dei dati dell'utente (None se l'utente non esiste)."""
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT data_version FROM users WHERE chat_id = ?", (chat_id,))
+        row = cur.fetchone()
+        return row["data_version"] if row else None
+
+def delete_user(db_path: str, chat_id: int) -> bool:
+    """Elimina l'utente e, a cascata, veicoli, interventi, promemoria e tipi."""
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        user_id = lookup_user(conn, db_path, chat_id)
+        if user_id is None:
+            return False
+        cur.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        conn.commit()
+        _user_ids.pop((db_path, chat_id))
+        _vehicles_cache.pop((db_path, user_id))
+        _types_cache.pop((db_path, user_id))
+        return cur.rowcount > 0
+
+def get_user_chat_id(db_path: str, user_id: int) -> Optional[int]:
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT chat_id FROM users WHERE id = ?", (user_id,))
+        row = cur.fetchone()
+        return row["chat_id"] if row else None
+
+def get_vehicle_chat_id(db_path: str, vehicle_id: int) -> Optional[int]:
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT u.chat_id FROM users u JOIN vehicles v ON v.user_id = u.id WHERE v.id = ?", (vehicle_id,))
+        row = cur.fetchone()
+        return row["chat_id"] if row else None
 
 # Vehicles
 def add_vehicle(db_path: str, chat_id: int, alias: str, plate: str, brand: str, model: str, year: Optional[int], notes: Optional[str]) -> int:
-    conn = _connect(db_path)
-    with closing(conn):
-        user_id = ensure_user(conn, chat_id)
+    with _db(db_path) as conn:
+        user_id = ensure_user(conn, db_path, chat_id)
         now = datetime.utcnow().isoformat()
         cur = conn.cursor()
         cur.execute(
@@ -105,79 +606,205 @@ def add_vehicle(db_path: str, chat_id: int, alias: str, plate: str, brand: str,
             (user_id, alias, plate, brand, model, year, notes, now)
         )
         conn.commit()
+        _vehicles_cache.pop((db_path, user_id))
         return cur.lastrowid
 
 def list_vehicles(db_path: str, chat_id: int) -> List[sqlite3.Row]:
-    conn = _connect(db_path)
-    with closing(conn):
-        user_id = ensure_user(conn, chat_id)
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM vehicles WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
-        return cur.fetchall()
+    with _db(db_path) as conn:
+        user_id = lookup_user(conn, db_path, chat_id)
+        if user_id is None:
+            return []
+        rows = _vehicles_cache.get((db_path, user_id))
+        if rows is None:
+            cur = conn.cursor()
+            cur.execute("SELECT * FROM vehicles WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
+            rows = cur.fetchall()
+            _vehicles_cache.put((db_path, user_id), rows)
+        return list(rows)
 
 def get_vehicle(db_path: str, vehicle_id: int) -> Optional[sqlite3.Row]:
-    conn = _connect(db_path)
-    with closing(conn):
+    with _db(db_path) as conn:
         cur = conn.cursor()
         cur.execute("SELECT * FROM vehicles WHERE id = ?", (vehicle_id,))
         return cur.fetchone()
 
 def update_vehicle_km(db_path: str, vehicle_id: int, km: int):
-    conn = _connect(db_path)
-    with closing(conn):
+    with _db(db_path) as conn:
+        user_id = _vehicle_owner(conn, vehicle_id)
         cur = conn.cursor()
         cur.execute("UPDATE vehicles SET km_current = ? WHERE id = ?", (km, vehicle_id))
         conn.commit()
+        _vehicles_cache.pop((db_path, user_id))
 
 def delete_vehicle(db_path: str, vehicle_id: int):
-    conn = _connect(db_path)
-    with closing(conn):
+    with _db(db_path) as conn:
+        user_id = _vehicle_owner(conn, vehicle_id)
         cur = conn.cursor()
         cur.execute("DELETE FROM vehicles WHERE id = ?", (vehicle_id,))
         conn.commit()
+        _vehicles_cache.pop((db_path, user_id))
 
 # Maintenance
 def add_maintenance(db_path: str, vehicle_id: int, date_iso: str, km: Optional[int], mtype: str, notes: Optional[str], cost: Optional[float]) -> int:
-    conn = _connect(db_path)
-    with closing(conn):
+    with _db(db_path) as conn:
         now = datetime.utcnow().isoformat()
         cur = conn.cursor()
         cur.execute(
             "INSERT INTO maintenance (vehicle_id, date, km, type, notes, cost, created_at) VALUES (?,?,?,?,?,?,?)",
             (vehicle_id, date_iso, km, mtype, notes, cost, now)
         )
+        rec_id = cur.lastrowid
+        if km is not None:
+            # i km dell'intervento sono una lettura del contachilometri: il veicolo non può averne meno
+            cur.execute("UPDATE vehicles SET km_current = ? WHERE id = ? AND COALESCE(km_current, 0) < ?", (km, vehicle_id, km))
+            km_changed = cur.rowcount > 0
+        else:
+            km_changed = False
+        _summary_add(cur, vehicle_id, date_iso, km, mtype, cost)
         conn.commit()
-        return cur.lastrowid
+        if km_changed:
+            _vehicles_cache.pop((db_path, _vehicle_owner(conn, vehicle_id)))
+        return rec_id
 
-def list_maintenance(db_path: str, vehicle_id: int, limit: int = 50) -> List[sqlite3.Row]:
-    conn = _connect(db_path)
-    with closing(conn):
+def _summary_add(cur, vehicle_id: int, date_iso: str, km: Optional[int], mtype: str, cost: Optional[float]):
+    # il nuovo intervento ha l'id più alto: a parità di data diventa lui l'ultimo
+    cur.execute(
+        """INSERT INTO vehicle_summary (vehicle_id, count, total_cost, last_date, last_km, first_km)
+           VALUES (?, 1, ?, ?, ?, ?)
+           ON CONFLICT(vehicle_id) DO UPDATE SET
+               count = count + 1,
+               total_cost = total_cost + excluded.total_cost,
+               last_km = CASE WHEN excluded.last_date >= COALESCE(last_date, '') THEN excluded.last_km ELSE last_km END,
+               last_date = MAX(COALESCE(last_date, ''), excluded.last_date),
+               first_km = COALESCE(MIN(first_km, excluded.first_km), first_km, excluded.first_km)""",
+        (vehicle_id, cost or 0, date_iso, km, km),
+    )
+    cur.execute(
+        """INSERT INTO vehicle_type_summary (vehicle_id, type, count, total_cost) VALUES (?, ?, 1, ?)
+           ON CONFLICT(vehicle_id, type) DO UPDATE SET
+               count = count + 1, total_cost = total_cost + excluded.total_cost""",
+        (vehicle_id, mtype, cost or 0),
+    )
+
+def get_user_summary(db_path: str, chat_id: int) -> List[Dict[str, Any]]:
+    """Riepilogo di ogni veicolo dell'utente; letture per chiave, non sugli interventi."""
+    with _db(db_path) as conn:
+        user_id = lookup_user(conn, db_path, chat_id)
+        if user_id is None:
+            return []
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT v.id, v.alias, v.brand, v.model, v.km_current, "
+            "COALESCE(s.count, 0) AS count, COALESCE(s.total_cost, 0) AS total_cost, s.last_date, s.last_km, s.first_km "
+            "FROM vehicles v LEFT JOIN vehicle_summary s ON s.vehicle_id = v.id "
+            "WHERE v.user_id = ? ORDER BY v.created_at DESC",
+            (user_id,),
+        )
+        summaries = [dict(r) for r in cur.fetchall()]
+        cur.execute(
+            "SELECT t.vehicle_id, t.type, t.count, t.total_cost FROM vehicle_type_summary t "
+            "JOIN vehicles v ON v.id = t.vehicle_id WHERE v.user_id = ? ORDER BY t.total_cost DESC, t.count DESC",
+            (user_id,),
+        )
+        by_type: Dict[int, list] = {}
+        for r in cur.fetchall():
+            by_type.setdefault(r["vehicle_id"], []).append(dict(r))
+        for s in summaries:
+            s["types"] = by_type.get(s["id"], [])
+        return summaries
+
+def rebuild_summaries(db_path: str, chat_id: Optional[int] = None) -> int:
+    """Ricalcola i riepiloghi dagli interventi (di un utente, o di tutti). Ritorna i veicoli ricalcolati."""
+    with _db(db_path) as conn:
         cur = conn.cursor()
-        cur.execute("SELECT * FROM maintenance WHERE vehicle_id = ? ORDER BY date DESC, id DESC LIMIT ?", (vehicle_id, limit))
+        if chat_id is None:
+            where, params = "", ()
+        else:
+            user_id = lookup_user(conn, db_path, chat_id)
+            if user_id is None:
+                return 0
+            where, params = "WHERE vehicle_id IN (SELECT id FROM vehicles WHERE user_id = ?)", (user_id,)
+        cur.execute("BEGIN IMMEDIATE")
+        for stmt in SUMMARY_REBUILD:
+            cur.execute(stmt.format(where=where), params)
+        cur.execute(f"SELECT COUNT(*) FROM vehicle_summary {where}", params)
+        n = cur.fetchone()[0]
+        conn.commit()
+        return n
+
+def list_maintenance(db_path: str, vehicle_id: int, limit: int = 50,
+                     before: Optional[Tuple[str, int]] = None,
+                     after: Optional[Tuple[str, int]] = None) -> List[sqlite3.Row]:
+    """Interventi dal più recente, paginati per chiave (date, id) senza OFFSET.
+
+    before=(date, id): solo quelli più vecchi del cursore; after=(date, id): solo
+    quelli più recenti (i `limit` più vicini al cursore). Sempre in ordine date DESC, id DESC.
+    """
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        if after is not None:
+            cur.execute(
+                "SELECT * FROM maintenance WHERE vehicle_id = ? AND (date, id) > (?, ?) "
+                "ORDER BY date ASC, id ASC LIMIT ?",
+                (vehicle_id, after[0], after[1], limit),
+            )
+            return cur.fetchall()[::-1]
+        if before is not None:
+            cur.execute(
+                "SELECT * FROM maintenance WHERE vehicle_id = ? AND (date, id) < (?, ?) "
+                "ORDER BY date DESC, id DESC LIMIT ?",
+                (vehicle_id, before[0], before[1], limit),
+            )
+        else:
+            cur.execute("SELECT * FROM maintenance WHERE vehicle_id = ? ORDER BY date DESC, id DESC LIMIT ?", (vehicle_id, limit))
         return cur.fetchall()
 
-def list_types(db_path: str, chat_id: int) -> list[str]:
-    conn = _connect(db_path)
-    with closing(conn):
-        user_id = ensure_user(conn, chat_id)
+def search_maintenance(db_path: str, chat_id: int, match: str, limit: int = 10, offset: int = 0) -> List[sqlite3.Row]:
+    """Interventi dell'utente che soddisfano `match` (sintassi FTS5), dal più pertinente.
+
+    Il filtro sull'utente è dentro la query FTS (colonna owner), così l'indice
+    incrocia subito i termini con i soli interventi dell'utente.
+    """
+    with _db(db_path) as conn:
+        user_id = lookup_user(conn, db_path, chat_id)
+        if user_id is None:
+            return []
         cur = conn.cursor()
         cur.execute(
-            "SELECT label FROM maintenance_types WHERE user_id = ? ORDER BY label",
-            (user_id,),
+            # pesi bm25 per colonna: owner, vehicle, type, notes
+            "SELECT m.*, v.alias, v.plate FROM maintenance_fts f "
+            "JOIN maintenance m ON m.id = f.rowid JOIN vehicles v ON v.id = m.vehicle_id "
+            "WHERE maintenance_fts MATCH ? "
+            "ORDER BY bm25(maintenance_fts, 0.0, 2.0, 5.0, 1.0), m.date DESC, m.id DESC LIMIT ? OFFSET ?",
+            (f"owner:u{user_id} AND ({match})", limit, offset),
         )
-        rows = cur.fetchall()
-        if not rows:
+        return cur.fetchall()
+
+def list_types(db_path: str, chat_id: int) -> list[str]:
+    with _db(db_path) as conn:
+        user_id = lookup_user(conn, db_path, chat_id)
+        labels = []
+        if user_id is not None:
+            labels = _types_cache.get((db_path, user_id))
+            if labels is None:
+                cur = conn.cursor()
+                cur.execute(
+                    "SELECT label FROM maintenance_types WHERE user_id = ? ORDER BY label",
+                    (user_id,),
+                )
+                labels = [r["label"] for r in cur.fetchall()]
+                _types_cache.put((db_path, user_id), labels)
+        if not labels:
             # fallback iniziale: i tuoi default
             return ["Tagliando", "Cambio olio", "Filtro aria", "Filtro abitacolo", "Pneumatici", "Freni", "Batteria", "Altro"]
-        return [r["label"] for r in rows]
+        return list(labels)
 
 def add_type(db_path: str, chat_id: int, label: str) -> None:
     label = label.strip()
     if not label:
         return
-    conn = _connect(db_path)
-    with closing(conn):
-        user_id = ensure_user(conn, chat_id)
+    with _db(db_path) as conn:
+        user_id = ensure_user(conn, db_path, chat_id)
         now = datetime.utcnow().isoformat()
         cur = conn.cursor()
         cur.execute(
@@ -185,23 +812,25 @@ def add_type(db_path: str, chat_id: int, label: str) -> None:
             (user_id, label, now),
         )
         conn.commit()
+        _types_cache.pop((db_path, user_id))
 
 def delete_type(db_path: str, chat_id: int, label: str) -> bool:
-    conn = _connect(db_path)
-    with closing(conn):
-        user_id = ensure_user(conn, chat_id)
+    with _db(db_path) as conn:
+        user_id = lookup_user(conn, db_path, chat_id)
+        if user_id is None:
+            return False
         cur = conn.cursor()
         cur.execute(
             "DELETE FROM maintenance_types WHERE user_id = ? AND label = ?",
             (user_id, label.strip()),
         )
         conn.commit()
+        _types_cache.pop((db_path, user_id))
         return cur.rowcount > 0
 
 # Reminders
 def add_time_reminder(db_path: str, vehicle_id: int, due_at_iso: str, description: str) -> int:
-    conn = _connect(db_path)
-    with closing(conn):
+    with _db(db_path) as conn:
         now = datetime.utcnow().isoformat()
         cur = conn.cursor()
         cur.execute(
@@ -212,8 +841,7 @@ def add_time_reminder(db_path: str, vehicle_id: int, due_at_iso: str, descriptio
         return cur.lastrowid
 
 def add_km_reminder(db_path: str, vehicle_id: int, km_threshold: int, description: str) -> int:
-    conn = _connect(db_path)
-    with closing(conn):
+    with _db(db_path) as conn:
         now = datetime.utcnow().isoformat()
         cur = conn.cursor()
         cur.execute(
@@ -224,36 +852,269 @@ def add_km_reminder(db_path: str, vehicle_id: int, km_threshold: int, descriptio
         return cur.lastrowid
 
 def list_active_time_reminders(db_path: str) -> List[sqlite3.Row]:
-    conn = _connect(db_path)
-    with closing(conn):
+    with _db(db_path) as conn:
         cur = conn.cursor()
         cur.execute("SELECT r.*, v.user_id, v.alias FROM reminders r JOIN vehicles v ON v.id = r.vehicle_id WHERE r.kind = 'time' AND r.active = 1")
         return cur.fetchall()
 
+def list_active_time_reminders_batch(db_path: str, after_id: int = 0, limit: int = 1000) -> List[sqlite3.Row]:
+    """Promemoria a data/ora attivi con id > after_id, già con chat_id: per scorrerli a blocchi."""
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT r.id, r.vehicle_id, r.due_at, r.description, u.chat_id "
+            "FROM reminders r JOIN vehicles v ON v.id = r.vehicle_id JOIN users u ON u.id = v.user_id "
+            "WHERE r.kind = 'time' AND r.active = 1 AND r.id > ? ORDER BY r.id LIMIT ?",
+            (after_id, limit),
+        )
+        return cur.fetchall()
+
+def list_time_reminders_window(db_path: str, after: Optional[Tuple[str, int]], until: str, limit: int = 1000) -> List[sqlite3.Row]:
+    """Promemoria a data/ora attivi con (due_at, id) > after e due_at <= until, in ordine di scadenza."""
+    after_due, after_id = after if after is not None else ("", 0)
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT r.id, r.vehicle_id, r.due_at, r.description, u.chat_id "
+            # senza statistiche (ANALYZE) il planner preferisce l'indice su (active, kind, id) e ordina in memoria
+            "FROM reminders r INDEXED BY idx_reminders_time_due "
+            "JOIN vehicles v ON v.id = r.vehicle_id JOIN users u ON u.id = v.user_id "
+            "WHERE r.kind = 'time' AND r.active = 1 AND (r.due_at, r.id) > (?, ?) AND r.due_at <= ? "
+            "ORDER BY r.due_at, r.id LIMIT ?",
+            (after_due, after_id, until, limit),
+        )
+        return cur.fetchall()
+
+def filter_active_reminders(db_path: str, ids: List[int]) -> set:
+    """Quali di questi promemoria sono ancora attivi (non inviati, veicolo non eliminato)."""
+    if not ids:
+        return set()
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"SELECT id FROM reminders WHERE active = 1 AND id IN ({','.join('?' * len(ids))})",
+            ids,
+        )
+        return {r[0] for r in cur.fetchall()}
+
+def get_max_reminder_id(db_path: str) -> int:
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM reminders")
+        return cur.fetchone()[0]
+
 def list_active_km_reminders(db_path: str) -> List[sqlite3.Row]:
-    conn = _connect(db_path)
-    with closing(conn):
+    with _db(db_path) as conn:
         cur = conn.cursor()
-        cur.execute("SELECT r.*, v.user_id, v.alias, v.km_current FROM reminders r JOIN vehicles v ON v.id = r.vehicle_id WHERE r.kind = 'km' AND r.active = 1")
+        cur.execute(
+            "SELECT r.*, v.user_id, v.alias, v.km_current, u.chat_id "
+            "FROM reminders r JOIN vehicles v ON v.id = r.vehicle_id JOIN users u ON u.id = v.user_id "
+            "WHERE r.kind = 'km' AND r.active = 1"
+        )
+        return cur.fetchall()
+
+def list_crossed_km_reminders(db_path: str, vehicle_id: int, km: int) -> List[sqlite3.Row]:
+    """Promemoria km attivi del veicolo con soglia <= km (solo quelli appena superati, via indice)."""
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT r.*, v.user_id, v.alias, v.km_current, u.chat_id "
+            "FROM reminders r JOIN vehicles v ON v.id = r.vehicle_id JOIN users u ON u.id = v.user_id "
+            "WHERE r.vehicle_id = ? AND r.kind = 'km' AND r.active = 1 AND r.km_threshold <= ?",
+            (vehicle_id, km),
+        )
         return cur.fetchall()
 
 def deactivate_reminder(db_path: str, reminder_id: int):
-    conn = _connect(db_path)
-    with closing(conn):
+    with _db(db_path) as conn:
         cur = conn.cursor()
         cur.execute("UPDATE reminders SET active = 0 WHERE id = ?", (reminder_id,))
         conn.commit()
 
 # Exports
+# Query dell'export per sezione; ognuna restituisce le righe di un solo utente
+EXPORT_QUERIES = {
+    "vehicles": "SELECT * FROM vehicles WHERE user_id = ?",
+    "maintenance": "SELECT m.*, v.alias FROM maintenance m JOIN vehicles v ON v.id = m.vehicle_id WHERE v.user_id = ? ORDER BY date",
+    "reminders": "SELECT r.*, v.alias FROM reminders r JOIN vehicles v ON v.id = r.vehicle_id WHERE v.user_id = ?",
+}
+EXPORT_BATCH = 500
+
 def fetch_user_export(db_path: str, chat_id: int) -> Dict[str, Any]:
-    conn = _connect(db_path)
-    with closing(conn):
-        user_id = ensure_user(conn, chat_id)
+    with _db(db_path) as conn:
+        user_id = lookup_user(conn, db_path, chat_id)
+        if user_id is None:
+            return {"vehicles": [], "maintenance": [], "reminders": []}
         cur = conn.cursor()
-        cur.execute("SELECT * FROM vehicles WHERE user_id = ?", (user_id,))
+        cur.execute(EXPORT_QUERIES["vehicles"], (user_id,))
         vehicles = [dict(row) for row in cur.fetchall()]
-        cur.execute("SELECT m.*, v.alias FROM maintenance m JOIN vehicles v ON v.id = m.vehicle_id WHERE v.user_id = ? ORDER BY date", (user_id,))
+        cur.execute(EXPORT_QUERIES["maintenance"], (user_id,))
         maint = [dict(row) for row in cur.fetchall()]
-        cur.execute("SELECT r.*, v.alias FROM reminders r JOIN vehicles v ON v.id = r.vehicle_id WHERE v.user_id = ?", (user_id,))
+        cur.execute(EXPORT_QUERIES["reminders"], (user_id,))
         rems = [dict(row) for row in cur.fetchall()]
         return {"vehicles": vehicles, "maintenance": maint, "reminders": rems}
+
+def iter_user_export(db_path: str, chat_id: int, section: str) -> Iterator[sqlite3.Row]:
+    """Scorre le righe di una sezione dell'export a blocchi, senza caricarle tutte.
+    Va consumato interamente nello stesso thread (la connessione è per-thread)."""
+    with _db(db_path) as conn:
+        user_id = lookup_user(conn, db_path, chat_id)
+        if user_id is None:
+            return
+        cur = conn.cursor()
+        try:
+            cur.execute(EXPORT_QUERIES[section], (user_id,))
+            while True:
+                rows = cur.fetchmany(EXPORT_BATCH)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            cur.close()
+
+# Import interventi (app/importer.py)
+def get_import_targets(db_path: str, chat_id: int) -> Dict[str, Any]:
+    """Veicoli dell'utente (id -> alias) e interventi già presenti (id -> (vehicle_id,
+    date, type, km, cost)), per collegare le righe importate e saltare quelle di un
+    export già reimportato."""
+    with _db(db_path) as conn:
+        user_id = ensure_user(conn, db_path, chat_id)
+        cur = conn.cursor()
+        cur.execute("SELECT id, alias FROM vehicles WHERE user_id = ?", (user_id,))
+        vehicles = {r["id"]: r["alias"] for r in cur.fetchall()}
+        cur.execute(
+            "SELECT m.id, m.vehicle_id, m.date, m.type, m.km, m.cost "
+            "FROM maintenance m JOIN vehicles v ON v.id = m.vehicle_id WHERE v.user_id = ?",
+            (user_id,),
+        )
+        return {"vehicles": vehicles, "maintenance": {r[0]: tuple(r)[1:] for r in cur.fetchall()}}
+
+def insert_maintenance_batch(db_path: str, rows: List[tuple]) -> int:
+    """Inserisce (vehicle_id, date, km, type, notes, cost) in una sola transazione.
+    Riepiloghi e km dei veicoli si sistemano a fine import con finish_import."""
+    now = datetime.utcnow().isoformat()
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        # le righe passano da una tabella temporanea e arrivano in maintenance con un
+        # solo INSERT ... SELECT: i trigger (FTS, data_version) girano dentro un'unica
+        # istruzione invece che una per riga, e FTS5 non svuota il suo buffer a ogni riga
+        cur.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS import_staging "
+            "(vehicle_id INTEGER, date TEXT, km INTEGER, type TEXT, notes TEXT, cost REAL, created_at TEXT)"
+        )
+        cur.execute("BEGIN IMMEDIATE")
+        cur.executemany("INSERT INTO temp.import_staging VALUES (?,?,?,?,?,?,?)", [(*r, now) for r in rows])
+        cur.execute(
+            "INSERT INTO maintenance (vehicle_id, date, km, type, notes, cost, created_at) "
+            "SELECT vehicle_id, date, km, type, notes, cost, created_at FROM temp.import_staging"
+        )
+        cur.execute("DELETE FROM temp.import_staging")
+        conn.commit()
+        return len(rows)
+
+def finish_import(db_path: str, chat_id: int) -> Dict[int, int]:
+    """Dopo un import: porta km_current almeno ai km più alti degli interventi e
+    ricalcola i riepiloghi. Ritorna vehicle_id -> km_current dei veicoli aggiornati."""
+    with _db(db_path) as conn:
+        user_id = lookup_user(conn, db_path, chat_id)
+        if user_id is None:
+            return {}
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT v.id, (SELECT MAX(km) FROM maintenance m WHERE m.vehicle_id = v.id) AS max_km "
+            "FROM vehicles v WHERE v.user_id = ? AND max_km > COALESCE(v.km_current, 0)",
+            (user_id,),
+        )
+        raised = {r["id"]: r["max_km"] for r in cur.fetchall()}
+        cur.executemany("UPDATE vehicles SET km_current = ? WHERE id = ?", [(km, vid) for vid, km in raised.items()])
+        conn.commit()
+        _vehicles_cache.pop((db_path, user_id))
+    rebuild_summaries(db_path, chat_id)
+    return raised
+
+# Lease fra processi (app/leader.py)
+def acquire_lease(db_path: str, name: str, holder: str, ttl: float) -> bool:
+    """Prende o rinnova il lease `name` per `ttl` secondi se è libero, scaduto o già di `holder`."""
+    now = time.time()
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO leases (name, holder, expires_at) VALUES (?,?,?) "
+            "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+            (name, holder, now + ttl, now),
+        )
+        conn.commit()
+        return cur.rowcount > 0
+
+def release_lease(db_path: str, name: str, holder: str) -> bool:
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+        conn.commit()
+        return cur.rowcount > 0
+
+# Persistenza PTB
+def load_persistence(db_path: str, kind: str, key: str) -> Optional[bytes]:
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT data FROM persistence WHERE kind = ? AND key = ?", (kind, key))
+        row = cur.fetchone()
+        return row["data"] if row else None
+
+def load_persistence_kind(db_path: str, kind: str) -> List[sqlite3.Row]:
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT key, data FROM persistence WHERE kind = ?", (kind,))
+        return cur.fetchall()
+
+def save_persistence(db_path: str, items: List[tuple]):
+    """Scrive in una sola transazione una lista di (kind, key, data); data None = cancella."""
+    now = datetime.utcnow().isoformat()
+    upserts = [(kind, key, data, now) for kind, key, data in items if data is not None]
+    deletes = [(kind, key) for kind, key, data in items if data is None]
+    with _db(db_path) as conn:
+        cur = conn.cursor()
+        if upserts:
+            cur.executemany(
+                "INSERT INTO persistence (kind, key, data, updated_at) VALUES (?,?,?,?) "
+                "ON CONFLICT(kind, key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                upserts,
+            )
+        if deletes:
+            cur.executemany("DELETE FROM persistence WHERE kind = ? AND key = ?", deletes)
+        conn.commit()
+
+# Osservatore delle chiamate (app/metrics.py): ogni funzione che apre il DB (primo
+# argomento db_path) riporta nome, durata ed esito. Il wrapping avviene qui, al
+# caricamento del modulo, così lo vedono anche astorage e gli import diretti.
+_observer: Optional[Callable[[str, float, bool], None]] = None
+
+def set_observer(fn: Optional[Callable[[str, float, bool], None]]):
+    global _observer
+    _observer = fn
+
+def _observed(fn: Callable) -> Callable:
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _observer is None:
+            return fn(*args, **kwargs)
+        started = time.perf_counter()
+        ok = False
+        try:
+            result = fn(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            _observer(name, time.perf_counter() - started, ok)
+    return wrapper
+
+for _name, _fn in list(globals().items()):
+    # i generatori (iter_user_export) restituiscono subito: la durata non direbbe nulla
+    if (inspect.isfunction(_fn) and _fn.__module__ == __name__ and not _name.startswith("_")
+            and not inspect.isgeneratorfunction(_fn)
+            and next(iter(inspect.signature(_fn).parameters), None) == "db_path"):
+        globals()[_name] = _observed(_fn)
+del _name, _fn
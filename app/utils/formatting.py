@@ -206,6 +206,22 @@ def format_vehicle(v) -> str:
     parts = [p for p in [v.get("alias"), v.get("plate"), v.get("brand"), v.get("model")] if p]
     return " · ".join(parts)
 
+def format_maintenance(r, max_len: Optional[int] = None, vehicle: Optional[str] = None) -> str:
+    """Riga di storico: '• data — [veicolo —] tipo (km) — €costo — note', tagliata a max_len."""
+    line = f"• {r['date']} — "
+    if vehicle:
+        line += f"{vehicle} — "
+    line += r["type"]
+    if r["km"]:
+        line += f" ({r['km']} km)"
+    if r["cost"]:
+        line += f" — €{r['cost']:.2f}"
+    if r["notes"]:
+        line += f" — {r['notes']}"
+    if max_len is not None and len(line) > max_len:
+        line = line[:max_len - 1] + "…"
+    return line
+
 def human_date(d_iso: str) -> str:
     """'2025-08-22' -> '22/08/2025'"""
     try:
@@ -0,0 +1,28 @@
+import tempfile
+
+
+class SpooledBuffer(tempfile.SpooledTemporaryFile):
+    """File temporaneo in memoria (BytesIO) che passa su disco oltre max_size.
+
+    Come SpooledTemporaryFile, più readable/seekable/writable/read1/readinto che
+    la stdlib aggiunge solo da Python 3.11: zipfile e io.TextIOWrapper li usano,
+    e su 3.10 senza di loro export e import fallirebbero con AttributeError.
+    """
+
+    def readable(self):
+        return self._file.readable()
+
+    def seekable(self):
+        return self._file.seekable()
+
+    def writable(self):
+        return self._file.writable()
+
+    def read1(self, *args):
+        return self._file.read1(*args)
+
+    def readinto(self, b):
+        return self._file.readinto(b)
+
+    def readinto1(self, b):
+        return self._file.readinto1(b)
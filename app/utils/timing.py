@@ -0,0 +1,33 @@
+from __future__ import annotations
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class PhaseTimer:
+    """Cronometra le fasi di avvio (import, DB, promemoria, handler...) e le riassume nel log."""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def summary(self) -> str:
+        parts = [f"{name} {secs * 1000:.0f}ms" for name, secs in self.phases.items()]
+        total = time.perf_counter() - self.started
+        return f"{', '.join(parts)} — totale {total * 1000:.0f}ms"
+
+    def log(self, title: str = "Avvio"):
+        logger.info("%s: %s", title, self.summary())
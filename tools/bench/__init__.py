@@ -0,0 +1,12 @@
+"""
+Benchmark dello storage e dell'export su dati sintetici.
+
+    python -m tools.bench generate --db /tmp/bench.db --users 100000 --maintenance 1000000
+    python -m tools.bench run --db /tmp/bench.db --out prima.json
+    python -m tools.bench run --db /tmp/bench.db --out dopo.json
+    python -m tools.bench compare prima.json dopo.json
+
+`generate` crea un DB deterministico (stesso seed, stessi dati); `run` misura gli
+scenari di tools/bench/scenarios.py, ognuno in un processo a sé, e scrive p50/p95,
+throughput e picco di RSS in JSON; `compare` confronta due run.
+"""
@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields
+from multiprocessing import get_context
+from pathlib import Path
+
+from tools.bench import __doc__ as DOC
+from tools.bench.datagen import DataSpec, generate
+from tools.bench.scenarios import SCENARIOS, run_scenario
+
+ROOT = Path(__file__).resolve().parent.parent.parent
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def cmd_generate(args):
+    if os.path.exists(args.db):
+        raise SystemExit(f"{args.db} esiste già: scegli un altro percorso o cancellalo")
+    spec = DataSpec(**{f.name: getattr(args, f.name) for f in fields(DataSpec)})
+    print(json.dumps(generate(args.db, spec), indent=2))
+
+
+def cmd_run(args):
+    names = args.scenario or list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Scenari sconosciuti: {', '.join(sorted(unknown))} (disponibili: {', '.join(SCENARIOS)})")
+    meta_path = args.db + ".json"
+    report = {
+        "meta": {
+            "db": os.path.abspath(args.db),
+            "data": json.load(open(meta_path)) if os.path.exists(meta_path) else None,
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "scenarios": {},
+    }
+    for name in names:
+        ops = args.ops or SCENARIOS[name][1]
+        # un processo nuovo per scenario: cache e RSS non si trascinano da uno all'altro
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+            result = pool.submit(run_scenario, name, args.db, ops, args.seed, args.slow_ms).result()
+        report["scenarios"][name] = result
+        print(f"{name:26} p50 {result['p50_ms']:>9.3f} ms  p95 {result['p95_ms']:>9.3f} ms  "
+              f"{result['ops_per_s']:>9} op/s  rss {result['peak_rss_mb']} MB", file=sys.stderr)
+        for e in result.get("slow_queries", [])[:3]:
+            print(f"  lenta {e['count']:>6}× max {e['max_s'] * 1000:.1f} ms  {e['statement'][:80]}", file=sys.stderr)
+            for line in e["plan"]:
+                print(f"      {line}", file=sys.stderr)
+    out = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(out)
+    else:
+        print(out)
+
+
+def cmd_compare(args):
+    before, after = (json.load(open(p))["scenarios"] for p in (args.before, args.after))
+    print(f"{'scenario':26} {'p50':>18} {'p95':>18} {'op/s':>18} {'rss MB':>14}")
+    for name in [n for n in before if n in after]:
+        cells = []
+        for key in ("p50_ms", "p95_ms", "ops_per_s", "peak_rss_mb"):
+            a, b = before[name][key], after[name][key]
+            delta = f"{(b - a) / a * 100:+.0f}%" if a else "n/d"
+            cells.append(f"{b:>10} {delta:>6}")
+        print(f"{name:26} " + " ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m tools.bench", description=DOC,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    gen = sub.add_parser("generate", help="crea un DB sintetico deterministico")
+    gen.add_argument("--db", required=True)
+    defaults = DataSpec()
+    gen.add_argument("--users", type=int, default=defaults.users)
+    gen.add_argument("--vehicles-per-user", dest="vehicles_per_user", type=float, default=defaults.vehicles_per_user)
+    gen.add_argument("--maintenance", type=int, default=defaults.maintenance, help="interventi totali")
+    gen.add_argument("--reminders", type=int, default=defaults.reminders, help="promemoria attivi")
+    gen.add_argument("--seed", type=int, default=defaults.seed)
+    gen.set_defaults(func=cmd_generate)
+
+    run = sub.add_parser("run", help="misura gli scenari su un DB")
+    run.add_argument("--db", required=True)
+    run.add_argument("--scenario", action="append", help=f"ripetibile; default tutti ({', '.join(SCENARIOS)})")
+    run.add_argument("--ops", type=int, default=0, help="operazioni per scenario (default: quelle dello scenario)")
+    run.add_argument("--seed", type=int, default=1)
+    run.add_argument("--out", help="file JSON del risultato (default: stdout)")
+    run.add_argument("--slow-ms", dest="slow_ms", type=float, default=0,
+                     help="registra gli statement oltre questa soglia con il loro EXPLAIN QUERY PLAN")
+    run.set_defaults(func=cmd_run)
+
+    cmp = sub.add_parser("compare", help="confronta due risultati JSON")
+    cmp.add_argument("before")
+    cmp.add_argument("after")
+    cmp.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Generatore deterministico di dati sintetici per i benchmark.
+
+Scrive direttamente con sqlite3 a blocchi (le funzioni di storage inseriscono una
+riga per transazione: per un milione di interventi servirebbero ore), poi
+ricalcola i riepiloghi come dopo un import. Gli interventi non sono divisi in
+parti uguali: pochi veicoli ne hanno molti, come nei dati veri, così p95 ed
+export vedono anche gli utenti pesanti.
+"""
+import json
+import random
+import sqlite3
+import time
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta
+from typing import Iterator, List
+
+from app import storage
+
+FIRST_CHAT_ID = 10_000_000
+CHUNK = 50_000
+
+TYPES = ["Tagliando", "Cambio olio", "Gomme", "Freni", "Revisione", "Batteria", "Filtro aria",
+         "Distribuzione", "Carrozzeria", "Climatizzatore"]
+BRANDS = [("Fiat", "Panda"), ("Fiat", "500"), ("Volkswagen", "Golf"), ("Toyota", "Yaris"),
+          ("Renault", "Clio"), ("Ford", "Fiesta"), ("Peugeot", "208"), ("Dacia", "Sandero")]
+NOTES = ["", "", "officina sotto casa", "olio 5W30", "pastiglie anteriori", "gomme invernali",
+         "fatto in concessionaria", "controllo livelli", "ricarica gas clima", "sostituita cinghia"]
+
+
+@dataclass
+class DataSpec:
+    users: int = 1000
+    vehicles_per_user: float = 1.5
+    maintenance: int = 10_000
+    reminders: int = 2000  # attivi, metà a data/ora e metà a km
+    seed: int = 42
+
+
+def _chunks(it: Iterator[tuple], size: int = CHUNK) -> Iterator[List[tuple]]:
+    buf = []
+    for row in it:
+        buf.append(row)
+        if len(buf) >= size:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+
+def _plate(rng: random.Random) -> str:
+    letters = "ABCDEFGHJKLMNPRSTVWXYZ"
+    return (rng.choice(letters) + rng.choice(letters) + f"{rng.randrange(1000):03d}"
+            + rng.choice(letters) + rng.choice(letters))
+
+
+def generate(db_path: str, spec: DataSpec) -> dict:
+    """Crea il DB (che deve essere nuovo) e ritorna i conteggi e il tempo impiegato."""
+    started = time.perf_counter()
+    storage.init_db(db_path)
+    storage.close_all()
+    rng = random.Random(spec.seed)
+    now = datetime(2025, 1, 1).isoformat()
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    cur = conn.cursor()
+
+    for chunk in _chunks((FIRST_CHAT_ID + i, now) for i in range(spec.users)):
+        cur.executemany("INSERT INTO users (chat_id, created_at) VALUES (?, ?)", chunk)
+        conn.commit()
+
+    # veicoli per utente: almeno uno, in media vehicles_per_user
+    extra = max(0.0, spec.vehicles_per_user - 1)
+    def vehicles():
+        for user_id in range(1, spec.users + 1):
+            n = 1 + int(extra) + (1 if rng.random() < extra - int(extra) else 0)
+            for k in range(n):
+                brand, model = rng.choice(BRANDS)
+                yield (user_id, f"Auto {k + 1}", _plate(rng), brand, model, rng.randrange(2000, 2025),
+                       None, rng.randrange(5_000, 250_000), now)
+    for chunk in _chunks(vehicles()):
+        cur.executemany(
+            "INSERT INTO vehicles (user_id, alias, plate, brand, model, year, notes, km_current, created_at) "
+            "VALUES (?,?,?,?,?,?,?,?,?)", chunk)
+        conn.commit()
+    n_vehicles = cur.execute("SELECT MAX(id) FROM vehicles").fetchone()[0] or 0
+
+    # interventi per veicolo con coda lunga (Pareto), normalizzati al totale richiesto
+    weights = [rng.paretovariate(1.2) for _ in range(n_vehicles)]
+    scale = spec.maintenance / sum(weights) if weights else 0
+    counts = [int(w * scale) for w in weights]
+    for i in range(spec.maintenance - sum(counts)):
+        counts[i % n_vehicles] += 1
+    start_day, span = date(2010, 1, 1), (date(2025, 1, 1) - date(2010, 1, 1)).days
+    def maintenance():
+        for vid, n in enumerate(counts, start=1):
+            day, km = start_day + timedelta(days=rng.randrange(1000)), rng.randrange(0, 20_000)
+            # passo medio span/n: anche i veicoli con migliaia di interventi restano prima del 2025
+            step = max(2, min(60, 2 * (span - 1000) // max(n, 1)))
+            for _ in range(n):
+                day += timedelta(days=rng.randrange(1, step))
+                km += rng.randrange(100, 3000)
+                yield (vid, day.isoformat(), km, rng.choice(TYPES), rng.choice(NOTES) or None,
+                       round(rng.uniform(20, 900), 2), now)
+    for chunk in _chunks(maintenance()):
+        cur.executemany(
+            "INSERT INTO maintenance (vehicle_id, date, km, type, notes, cost, created_at) VALUES (?,?,?,?,?,?,?)",
+            chunk)
+        conn.commit()
+
+    due_base = datetime(2026, 1, 1)
+    def reminders():
+        for i in range(spec.reminders):
+            vid = rng.randrange(1, n_vehicles + 1)
+            if i % 2:
+                yield (vid, "time", (due_base + timedelta(minutes=rng.randrange(525_600))).strftime("%Y-%m-%d %H:%M"),
+                       None, rng.choice(TYPES), now)
+            else:
+                yield (vid, "km", None, rng.randrange(10_000, 300_000), rng.choice(TYPES), now)
+    for chunk in _chunks(reminders()):
+        cur.executemany(
+            "INSERT INTO reminders (vehicle_id, kind, due_at, km_threshold, description, created_at) "
+            "VALUES (?,?,?,?,?,?)", chunk)
+        conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+    storage.rebuild_summaries(db_path)
+    storage.close_all()
+    result = {"spec": asdict(spec), "vehicles": n_vehicles, "generate_s": round(time.perf_counter() - started, 2)}
+    with open(db_path + ".json", "w") as f:
+        json.dump(result, f, indent=2)
+    return result
@@ -0,0 +1,123 @@
+"""
+Scenari del benchmark. Ognuno riceve il DB, un Random con seed fisso e il numero
+di operazioni, e ritorna la lista dei tempi (secondi) di ogni operazione.
+
+Utenti e veicoli bersaglio si leggono dal DB, così `run` funziona anche su una
+copia del DB reale. Le cache di lettura di storage restano attive come nel bot:
+il risultato riporta anche il loro hit rate.
+"""
+import random
+import resource
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from app import storage
+
+HISTORY_PAGE = 10
+WARMUP = 5
+
+
+def _chat_ids(db_path: str) -> List[int]:
+    with storage._db(db_path) as conn:
+        return [r[0] for r in conn.execute("SELECT chat_id FROM users ORDER BY id")]
+
+
+def _vehicle_ids(db_path: str) -> List[int]:
+    with storage._db(db_path) as conn:
+        return [r[0] for r in conn.execute("SELECT id FROM vehicles ORDER BY id")]
+
+
+def _timed(fn: Callable, args: List[Tuple]) -> List[float]:
+    times = []
+    for a in args:
+        t = time.perf_counter()
+        fn(*a)
+        times.append(time.perf_counter() - t)
+    return times
+
+
+def list_vehicles(db_path: str, rng: random.Random, ops: int) -> List[float]:
+    users = _chat_ids(db_path)
+    return _timed(storage.list_vehicles, [(db_path, rng.choice(users)) for _ in range(ops)])
+
+
+def list_maintenance(db_path: str, rng: random.Random, ops: int) -> List[float]:
+    """Prima pagina dello storico più la pagina successiva (keyset), come in history_show."""
+    vehicles = _vehicle_ids(db_path)
+
+    def two_pages(vid):
+        rows = storage.list_maintenance(db_path, vid, HISTORY_PAGE + 1)
+        if len(rows) > HISTORY_PAGE:
+            last = rows[HISTORY_PAGE - 1]
+            storage.list_maintenance(db_path, vid, HISTORY_PAGE + 1, before=(last["date"], last["id"]))
+    return _timed(two_pages, [(rng.choice(vehicles),) for _ in range(ops)])
+
+
+def list_active_km_reminders(db_path: str, rng: random.Random, ops: int) -> List[float]:
+    return _timed(storage.list_active_km_reminders, [(db_path,)] * ops)
+
+
+def fetch_user_export(db_path: str, rng: random.Random, ops: int) -> List[float]:
+    users = _chat_ids(db_path)
+    return _timed(storage.fetch_user_export, [(db_path, rng.choice(users)) for _ in range(ops)])
+
+
+def export_build(db_path: str, rng: random.Random, ops: int) -> List[float]:
+    """Export completo (CSV + XLSX nello zip) come lo costruisce /export."""
+    from app.exporter import build_export
+    users = _chat_ids(db_path)
+
+    def build(chat_id):
+        build_export(db_path, chat_id).close()
+    return _timed(build, [(rng.choice(users),) for _ in range(ops)])
+
+
+# nome -> (funzione, operazioni di default)
+SCENARIOS: Dict[str, Tuple[Callable[[str, random.Random, int], List[float]], int]] = {
+    "list_vehicles": (list_vehicles, 20_000),
+    "list_maintenance": (list_maintenance, 10_000),
+    "list_active_km_reminders": (list_active_km_reminders, 20),
+    "fetch_user_export": (fetch_user_export, 500),
+    "export_build": (export_build, 100),
+}
+
+
+def _percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _rss_mb() -> float:
+    # ru_maxrss è in KB su Linux, in byte su macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_scenario(name: str, db_path: str, ops: int, seed: int, slow_ms: float = 0) -> dict:
+    """Da far girare in un processo nuovo: il picco di RSS è quello del solo scenario."""
+    fn, _ = SCENARIOS[name]
+    if slow_ms:
+        storage.set_slow_query_threshold(slow_ms / 1000)
+    rss_start = _rss_mb()
+    fn(db_path, random.Random(seed ^ 0xBEEF), min(WARMUP, ops))  # connessione aperta, moduli importati
+    started = time.perf_counter()
+    times = fn(db_path, random.Random(seed), ops)
+    elapsed = time.perf_counter() - started
+    storage.close_all()
+    result = {
+        "ops": len(times),
+        "p50_ms": round(statistics.median(times) * 1000, 3),
+        "p95_ms": round(_percentile(times, 0.95) * 1000, 3),
+        "max_ms": round(max(times) * 1000, 3),
+        "ops_per_s": round(len(times) / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": _rss_mb(),
+        "rss_growth_mb": round(_rss_mb() - rss_start, 1),
+        "cache": storage.cache_stats(),
+    }
+    if slow_ms:
+        result["slow_queries"] = [
+            {**e, "total_s": round(e["total_s"], 4), "max_s": round(e["max_s"], 4)} for e in storage.slow_query_report()
+        ]
+    return result
@@ -0,0 +1,82 @@
+"""
+Misura il tempo di avvio del bot: da `python -m app.main` alla prima chiamata
+getUpdates ricevuta dal finto Bot API (time-to-first-poll).
+
+    python -m tools.bench_startup --runs 5
+    python -m tools.bench_startup --runs 3 --db ./data/bot.db   # su una copia del DB reale
+
+Ogni run usa una cartella temporanea (pickle di persistenza incluso) e, se
+indicato, una copia del DB, così i promemoria da ripianificare sono realistici.
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from tools.fake_bot_api import FakeBotAPI
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def run_once(api_url: str, api: FakeBotAPI, db_src: str, timeout: float) -> dict:
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    db_path = os.path.join(workdir, "bot.db")
+    if db_src:
+        shutil.copy(db_src, db_path)
+    env = {**os.environ, "BOT_TOKEN": "123:BENCH", "BOT_API_URL": api_url, "DB_PATH": db_path,
+           "PYTHONPATH": str(ROOT) + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    api.first_poll_at = None
+    started = time.monotonic()
+    proc = subprocess.Popen([sys.executable, "-m", "app.main"], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        while api.first_poll_at is None:
+            if proc.poll() is not None:
+                raise RuntimeError(f"il bot è uscito con codice {proc.returncode}:\n{proc.stderr.read()}")
+            if time.monotonic() - started > timeout:
+                raise TimeoutError("nessun getUpdates entro il timeout")
+            time.sleep(0.005)
+        first_poll = api.first_poll_at - started
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            _, stderr = proc.communicate(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            _, stderr = proc.communicate()
+        shutil.rmtree(workdir, ignore_errors=True)
+    # riga "Avvio: import ..ms, db ..ms, ..." scritta da post_init
+    phases = next((line.split("INFO - ", 1)[1] for line in stderr.splitlines() if "INFO - Avvio:" in line), "")
+    return {"first_poll_s": round(first_poll, 4), "phases": phases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--db", default="", help="DB da copiare per ogni run (default: DB vuoto)")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    api = FakeBotAPI().start()
+    try:
+        results = [run_once(api.url, api, args.db, args.timeout) for _ in range(args.runs)]
+    finally:
+        api.stop()
+    times = [r["first_poll_s"] for r in results]
+    print(json.dumps({
+        "runs": results,
+        "min_s": min(times),
+        "median_s": round(statistics.median(times), 4),
+        "max_s": max(times),
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Finto server Bot API di Telegram, solo libreria standard, per prove in locale.
+
+Risponde ai metodi usati dal bot (getMe, getUpdates, sendMessage, sendDocument,
+editMessageText, answerCallbackQuery, ...) e registra tutte le chiamate.
+Il bot va puntato qui con BOT_API_URL=http://127.0.0.1:<porta>/bot
+
+Uso da riga di comando:
+    python -m tools.fake_bot_api --port 8081 --retry-after-every 10
+"""
+from __future__ import annotations
+
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LibrettoTest", "username": "libretto_test_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+# metodi che rispondono con un Message
+MESSAGE_METHODS = {"sendMessage", "sendDocument", "editMessageText", "editMessageReplyMarkup", "sendPhoto"}
+
+
+def _decode_value(v: str) -> Any:
+    # PTB manda i parametri non stringa codificati in JSON
+    try:
+        return json.loads(v)
+    except ValueError:
+        return v
+
+
+def _parse_body(content_type: str, body: bytes) -> Dict[str, Any]:
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("multipart/form-data"):
+        msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        params = {}
+        for part in msg.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                params[name] = {"filename": part.get_filename(), "size": len(part.get_payload(decode=True) or b"")}
+            else:
+                params[name] = _decode_value(part.get_content())
+        return params
+    return {k: _decode_value(v) for k, v in parse_qsl(body.decode())}
+
+
+class _Server(ThreadingHTTPServer):
+    # backlog di listen() ampio: col default (5) sotto carico le connessioni in
+    # eccesso perdono il SYN e ritentano dopo 1 s, falsando le latenze
+    request_queue_size = 256
+    daemon_threads = True
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, retry_after_every: int = 0,
+                 retry_after: int = 1, latency: float = 0.0):
+        self.retry_after_every = retry_after_every
+        self.retry_after = retry_after
+        self.latency = latency
+        self.calls: List[Dict[str, Any]] = []
+        self.first_poll_at: Optional[float] = None
+        self._updates: List[Dict[str, Any]] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._send_count = 0
+        self._cond = threading.Condition()
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self._server = _Server((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self) -> "FakeBotAPI":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def on_call(self, listener: Callable[[str, Dict[str, Any]], None]):
+        """Registra una callback(method, params) invocata a ogni chiamata ricevuta."""
+        self._listeners.append(listener)
+
+    def push_update(self, update: Dict[str, Any]) -> int:
+        """Accoda un update (senza update_id) per il prossimo getUpdates. Ritorna l'update_id."""
+        with self._cond:
+            update = {"update_id": next(self._update_ids), **update}
+            self._updates.append(update)
+            self._cond.notify_all()
+            return update["update_id"]
+
+    def calls_to(self, method: str) -> List[Dict[str, Any]]:
+        with self._cond:
+            return [c for c in self.calls if c["method"] == method]
+
+    # --- gestione metodi ---
+
+    def _get_updates(self, params: Dict[str, Any]):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self.first_poll_at is None:
+                self.first_poll_at = time.monotonic()
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            return self._updates[:limit]
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = params.get("chat_id") or 0
+        msg = {"message_id": params.get("message_id") or next(self._message_ids), "date": int(time.time()),
+               "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER}
+        if "text" in params:
+            msg["text"] = str(params["text"])
+        if "document" in params:
+            msg["document"] = {"file_id": f"doc-{msg['message_id']}", "file_unique_id": f"u{msg['message_id']}"}
+        return msg
+
+    def handle(self, method: str, params: Dict[str, Any]):
+        """Ritorna (status HTTP, corpo JSON)."""
+        with self._cond:
+            self.calls.append({"method": method, "params": params, "at": time.monotonic()})
+            if method in MESSAGE_METHODS:
+                self._send_count += 1
+                throttle = self.retry_after_every and self._send_count % self.retry_after_every == 0
+            else:
+                throttle = False
+        for listener in self._listeners:
+            listener(method, params)
+        if throttle:
+            return 429, {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {self.retry_after}",
+                         "parameters": {"retry_after": self.retry_after}}
+        if self.latency:
+            time.sleep(self.latency)
+        if method == "getMe":
+            result: Any = BOT_USER
+        elif method == "getUpdates":
+            result = self._get_updates(params)
+        elif method in MESSAGE_METHODS:
+            result = self._message(params)
+        elif method == "getWebhookInfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        else:
+            result = True
+        return 200, {"ok": True, "result": result}
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                method = self.path.rstrip("/").rsplit("/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                params = _parse_body(self.headers.get("Content-Type", ""), body)
+                status, payload = api.handle(method, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Finto server Bot API di Telegram")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--retry-after-every", type=int, default=0, help="risponde 429 ogni N invii")
+    parser.add_argument("--latency", type=float, default=0.0, help="ritardo per chiamata (s)")
+    args = parser.parse_args()
+    api = FakeBotAPI(args.host, args.port, args.retry_after_every, latency=args.latency)
+    print(f"Fake Bot API su {api.url} (BOT_API_URL)")
+    try:
+        api._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
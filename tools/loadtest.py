@@ -0,0 +1,303 @@
+"""
+Prova di carico end-to-end: avvia il bot (polling) contro il finto Bot API e
+fa girare da molte chat simulate in parallelo dei copioni di update, come li
+manderebbe un utente: /add_maintenance (con i suoi sei passi), /update_km, i
+tasti del menu "🚗 Veicoli" e "🛠️ Manutenzione", le callback veh:/hv:/hp:.
+
+    python -m tools.loadtest --chats 10,50,100,200 --duration 15
+    python -m tools.loadtest --chats 50 --concurrent-updates 16 --api-latency 0.05
+
+Ogni chat manda un update e aspetta la risposta del bot (sendMessage o
+editMessageText verso la sua chat) prima del passo successivo; i pulsanti si
+premono leggendo la callback_data dall'ultima tastiera ricevuta. Con
+CONCURRENT_UPDATES > 1 la risposta può arrivare prima che la conversazione passi
+allo stato successivo: fra un passo e l'altro si aspetta --think-time (default
+50 ms in quel caso), come farebbe una persona. Per ogni fase
+(numero di chat) riporta update/s e latenza per handler; quando raddoppiando le
+chat gli update/s non crescono più il processo è saturo.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app import storage
+from tools.fake_bot_api import BOT_USER, MESSAGE_METHODS, FakeBotAPI
+
+ROOT = Path(__file__).resolve().parent.parent
+FIRST_CHAT_ID = 70_000
+HISTORY_ROWS = 25  # interventi per veicolo già presenti: lo storico ha più pagine
+RECOVER_TIMEOUT = 1.0
+
+# copione -> passi (handler che risponde, "text" o "tap", testo o prefisso della callback_data)
+SCRIPTS = {
+    "add_maintenance": [
+        ("add_maintenance_start", "text", "/add_maintenance"),
+        ("add_maintenance_type", "tap", "mv:"),
+        ("add_maintenance_date", "tap", "mt:"),
+        ("add_maintenance_km", "text", "oggi"),
+        ("add_maintenance_notes", "text", "{km}"),
+        ("add_maintenance_cost", "text", "-"),
+        ("add_maintenance_save", "text", "89.90"),
+    ],
+    "update_km": [
+        ("update_km_start", "text", "/update_km"),
+        ("update_km_choose", "tap", "kmv:"),
+        ("update_km_save", "text", "{km}"),
+    ],
+    "vehicles_menu": [
+        ("list_vehicles", "text", "🚗 Veicoli"),
+        ("on_vehicle_pressed", "tap", "veh:"),
+    ],
+    "history": [
+        ("history", "text", "🛠️ Manutenzione"),
+        ("history_show", "tap", "hv:"),
+        ("history_show", "tap", "hp:"),
+    ],
+}
+DEFAULT_MIX = "add_maintenance=1,update_km=1,vehicles_menu=2,history=2"
+
+
+def _percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _latency_stats(values: List[float]) -> dict:
+    return {"count": len(values),
+            "p50_ms": round(statistics.median(values) * 1000, 1),
+            "p95_ms": round(_percentile(values, 0.95) * 1000, 1),
+            "max_ms": round(max(values) * 1000, 1)}
+
+
+def _user(chat_id: int) -> dict:
+    return {"id": chat_id, "is_bot": False, "first_name": f"Carico {chat_id}"}
+
+
+def message_update(chat_id: int, message_id: int, text: str) -> dict:
+    msg = {"message_id": message_id, "date": int(time.time()), "text": text,
+           "chat": {"id": chat_id, "type": "private"}, "from": _user(chat_id)}
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": msg}
+
+
+def callback_update(chat_id: int, query_id: str, data: str) -> dict:
+    return {"callback_query": {
+        "id": query_id, "from": _user(chat_id), "chat_instance": str(chat_id), "data": data,
+        "message": {"message_id": 1, "date": int(time.time()), "text": "…",
+                    "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER},
+    }}
+
+
+def seed_db(db_path: str, chats: int):
+    """Un veicolo per chat con HISTORY_ROWS interventi."""
+    storage.init_db(db_path)
+    rows = []
+    for i in range(chats):
+        vid = storage.add_vehicle(db_path, FIRST_CHAT_ID + i, f"Auto {i}", None, "Fiat", "Panda", 2015, None)
+        day = date(2020, 1, 1)
+        for k in range(HISTORY_ROWS):
+            rows.append((vid, (day + timedelta(days=30 * k)).isoformat(), 1000 * (k + 1), "Tagliando", None, 99.0))
+    storage.insert_maintenance_batch(db_path, rows)
+    storage.rebuild_summaries(db_path)
+    storage.close_all()
+
+
+class LoadTest:
+    def __init__(self, api: FakeBotAPI, mix: Dict[str, float], step_timeout: float, think_time: float = 0.0):
+        self.api = api
+        self.think_time = think_time
+        self.scripts = list(mix)
+        self.weights = [mix[s] for s in self.scripts]
+        self.step_timeout = step_timeout
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._waiting: Dict[int, asyncio.Future] = {}
+        self._keyboards: Dict[int, list] = {}
+        self._ids = itertools.count(1)
+        api.on_call(self._on_call)
+
+    def _on_call(self, method: str, params: dict):
+        # thread del server HTTP: il tempo si prende qui, il resto passa al loop
+        if method not in MESSAGE_METHODS or not params.get("chat_id") or self.loop is None:
+            return
+        self.loop.call_soon_threadsafe(self._on_reply, int(params["chat_id"]), params, time.monotonic())
+
+    def _on_reply(self, chat_id: int, params: dict, at: float):
+        markup = params.get("reply_markup")
+        if isinstance(markup, dict) and "inline_keyboard" in markup:
+            self._keyboards[chat_id] = [b for row in markup["inline_keyboard"] for b in row]
+        fut = self._waiting.pop(chat_id, None)
+        if fut is not None and not fut.done():
+            fut.set_result(at)
+
+    def _button(self, chat_id: int, prefix: str) -> Optional[str]:
+        for b in self._keyboards.get(chat_id, []):
+            if b.get("callback_data", "").startswith(prefix):
+                return b["callback_data"]
+        return None
+
+    async def _send(self, chat_id: int, update: dict, timeout: float) -> Optional[float]:
+        """Manda l'update e aspetta la prima risposta del bot alla chat. Ritorna la latenza o None."""
+        fut = self.loop.create_future()
+        self._waiting[chat_id] = fut
+        started = time.monotonic()
+        self.api.push_update(update)
+        try:
+            return await asyncio.wait_for(fut, timeout) - started
+        except asyncio.TimeoutError:
+            self._waiting.pop(chat_id, None)
+            return None
+
+    async def _chat(self, chat_id: int, rng: random.Random, stop_at: float, stats: dict):
+        km = 100_000 + chat_id
+        while time.monotonic() < stop_at:
+            script = rng.choices(self.scripts, self.weights)[0]
+            for label, kind, payload in SCRIPTS[script]:
+                if self.think_time:
+                    await asyncio.sleep(self.think_time)
+                if kind == "tap":
+                    data = self._button(chat_id, payload)
+                    if data is None:
+                        stats["errors"][f"{label}: nessun pulsante {payload}"] += 1
+                        break
+                    update = callback_update(chat_id, str(next(self._ids)), data)
+                else:
+                    km += 10
+                    update = message_update(chat_id, next(self._ids), payload.format(km=km))
+                latency = await self._send(chat_id, update, self.step_timeout)
+                if latency is None:
+                    stats["errors"][f"{label}: timeout"] += 1
+                    # esce da un'eventuale conversazione rimasta a metà
+                    await self._send(chat_id, message_update(chat_id, next(self._ids), "/cancel"), RECOVER_TIMEOUT)
+                    break
+                stats["latencies"][label].append(latency)
+                if time.monotonic() <= stop_at:
+                    stats["in_window"] += 1
+
+    async def stage(self, chats: int, duration: float, seed: int) -> dict:
+        self.loop = asyncio.get_running_loop()
+        stats = {"latencies": defaultdict(list), "errors": defaultdict(int), "in_window": 0}
+        started = time.monotonic()
+        # allo scadere ogni chat finisce il copione in corso: nessuna conversazione resta aperta
+        await asyncio.gather(*(self._chat(FIRST_CHAT_ID + i, random.Random(seed * 100_003 + i),
+                                          started + duration, stats) for i in range(chats)))
+        everything = [x for values in stats["latencies"].values() for x in values]
+        return {
+            "chats": chats,
+            "elapsed_s": round(time.monotonic() - started, 2),
+            "updates": len(everything),
+            # solo le risposte arrivate entro la durata della fase: la coda finale non la diluisce
+            "updates_per_s": round(stats["in_window"] / duration, 1),
+            **({"latency": _latency_stats(everything)} if everything else {}),
+            "errors": dict(stats["errors"]),
+            "handlers": {label: _latency_stats(v) for label, v in sorted(stats["latencies"].items())},
+        }
+
+
+def _parse_mix(s: str) -> Dict[str, float]:
+    mix = {}
+    for part in s.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCRIPTS:
+            raise SystemExit(f"Copione sconosciuto: {name} (disponibili: {', '.join(SCRIPTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def saturation(stages: List[dict], gain: float = 1.1) -> dict:
+    """Prima fase dopo la quale più chat non portano almeno il 10% di update/s in più."""
+    for prev, cur in zip(stages, stages[1:]):
+        if (cur["updates_per_s"] or 0) < (prev["updates_per_s"] or 0) * gain:
+            return {"saturated": True, "chats": prev["chats"], "updates_per_s": prev["updates_per_s"]}
+    best = stages[-1]
+    return {"saturated": False, "chats": best["chats"], "updates_per_s": best["updates_per_s"]}
+
+
+def run(args) -> dict:
+    levels = sorted({int(c) for c in args.chats.split(",")})
+    mix = _parse_mix(args.mix)
+    think_time = args.think_time if args.think_time is not None else (0.05 if args.concurrent_updates > 1 else 0.0)
+    api = FakeBotAPI(latency=args.api_latency).start()
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    db_path = os.path.join(workdir, "bot.db")
+    seed_db(db_path, levels[-1])
+    env = {**os.environ, "BOT_TOKEN": "123:LOAD", "BOT_API_URL": api.url, "DB_PATH": db_path, "TZ": "UTC",
+           "BOT_MODE": "polling", "CONCURRENT_UPDATES": str(args.concurrent_updates),
+           "PYTHONPATH": str(ROOT) + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    # stderr su file: sotto carico i log riempirebbero una pipe e bloccherebbero il bot
+    log = open(os.path.join(workdir, "bot.log"), "w+")
+    proc = subprocess.Popen([sys.executable, "-m", "app.main"], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=log)
+    try:
+        deadline = time.monotonic() + args.timeout
+        while api.first_poll_at is None:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                log.seek(0)
+                raise RuntimeError(f"il bot non ha iniziato il polling:\n{log.read()}")
+            time.sleep(0.01)
+        test = LoadTest(api, mix, args.step_timeout, think_time)
+        stages = []
+        for chats in levels:
+            result = asyncio.run(test.stage(chats, args.duration, args.seed))
+            stages.append(result)
+            lat = result.get("latency", {})
+            print(f"{chats:>5} chat  {result['updates_per_s']:>8} update/s  p50 {lat.get('p50_ms')} ms  "
+                  f"p95 {lat.get('p95_ms')} ms  errori {sum(result['errors'].values())}", file=sys.stderr)
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        log.close()
+        api.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "mix": mix,
+        "concurrent_updates": args.concurrent_updates,
+        "api_latency_s": args.api_latency,
+        "think_time_s": think_time,
+        "stages": stages,
+        "saturation": saturation(stages),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", default="10,50,100", help="chat simulate per fase, separate da virgola")
+    parser.add_argument("--duration", type=float, default=10.0, help="secondi per fase")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"pesi dei copioni ({', '.join(SCRIPTS)})")
+    parser.add_argument("--concurrent-updates", type=int, default=1, help="CONCURRENT_UPDATES del bot")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="ritardo del finto Bot API per chiamata (s)")
+    parser.add_argument("--think-time", type=float, default=None,
+                        help="pausa fra i passi di una chat (s); default 0, 0.05 con --concurrent-updates > 1")
+    parser.add_argument("--step-timeout", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="attesa massima per l'avvio del bot")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="file JSON del risultato (default: stdout)")
+    args = parser.parse_args()
+    out = json.dumps(run(args), indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(out)
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
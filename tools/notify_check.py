@@ -0,0 +1,63 @@
+"""
+Prova del dispatcher notifiche contro il finto Bot API locale.
+
+Crea un DB temporaneo con N promemoria, li accoda tutti e stampa i contatori
+sent/failed/retried, il tempo impiegato e quanti promemoria restano attivi.
+
+    python -m tools.notify_check --reminders 200 --chats 20 --retry-after-every 25
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from telegram import Bot
+
+from app import astorage, storage
+from app.notifications import Dispatcher
+from tools.fake_bot_api import FakeBotAPI
+
+
+async def run(args) -> dict:
+    api = FakeBotAPI(retry_after_every=args.retry_after_every, latency=args.latency).start()
+    db_path = os.path.join(tempfile.mkdtemp(), "notify.db")
+    storage.init_db(db_path)
+    reminders = []
+    for c in range(args.chats):
+        vid = storage.add_vehicle(db_path, 1000 + c, f"Auto {c}", None, None, None, None, None)
+        for _ in range(args.reminders // args.chats):
+            reminders.append((1000 + c, storage.add_time_reminder(db_path, vid, "2000-01-01 09:00", "Prova")))
+    bot = Bot("123:TEST", base_url=api.url)
+    await bot.initialize()
+    dispatcher = Dispatcher(bot, db_path, workers=args.workers, rate=args.rate, chat_rate=args.chat_rate)
+    dispatcher.start()
+    started = time.perf_counter()
+    for chat_id, rem_id in reminders:
+        dispatcher.submit(chat_id, f"⏰ Promemoria {rem_id}", rem_id)
+    await dispatcher.stop(timeout=args.timeout)
+    elapsed = time.perf_counter() - started
+    await bot.shutdown()
+    api.stop()
+    still_active = len(storage.list_active_time_reminders(db_path))
+    astorage.shutdown()
+    return {**dispatcher.stats, "submitted": len(reminders), "still_active": still_active,
+            "elapsed_s": round(elapsed, 3), "http_calls": len(api.calls_to("sendMessage"))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reminders", type=int, default=200)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=25.0)
+    parser.add_argument("--chat-rate", type=float, default=1.0)
+    parser.add_argument("--retry-after-every", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
+
+
+if __name__ == "__main__":
+    main()
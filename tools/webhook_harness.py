@@ -0,0 +1,191 @@
+"""
+Prova della modalità webhook: avvia il bot con BOT_MODE=webhook contro il finto
+Bot API, gli manda via HTTP update sintetici (/help da chat diverse) e misura il
+tempo fra la POST dell'update e la risposta sendMessage del bot.
+
+    python -m tools.webhook_harness --updates 200 --concurrency 20
+    python -m tools.webhook_harness --updates 500 --concurrent-updates 16
+    python -m tools.webhook_harness --cluster 4 --reminders 50   # app.cluster con 4 worker
+
+Controlla anche che una richiesta con secret sbagliato venga rifiutata (403) e,
+con --reminders, che ogni promemoria in scadenza arrivi una volta sola anche con
+più processi.
+"""
+import argparse
+import json
+import os
+import secrets
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app import storage
+from tools.fake_bot_api import FakeBotAPI
+
+ROOT = Path(__file__).resolve().parent.parent
+FIRST_CHAT_ID = 50_000
+REMINDER_CHAT_ID = 40_000
+REMINDER_DELAY = 3.0  # secondi dall'avvio del bot alla scadenza dei promemoria di prova
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def synthetic_update(update_id: int, chat_id: int, text: str = "/help") -> dict:
+    msg = {"message_id": update_id, "date": int(time.time()), "text": text,
+           "chat": {"id": chat_id, "type": "private"},
+           "from": {"id": chat_id, "is_bot": False, "first_name": "Test"}}
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": msg}
+
+
+def post_update(url: str, secret: str, update: dict) -> int:
+    req = urllib.request.Request(url, data=json.dumps(update).encode(), method="POST", headers={
+        "Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret})
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def _percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(args) -> dict:
+    api = FakeBotAPI().start()
+    replied = {}  # chat_id -> istante della sendMessage
+    reminders_sent = []  # testi dei promemoria ricevuti
+    lock = threading.Lock()
+    webhooks_set = threading.Semaphore(0)
+
+    def on_call(method, params):
+        if method == "sendMessage":
+            chat_id = int(params.get("chat_id") or 0)
+            with lock:
+                if chat_id == REMINDER_CHAT_ID:
+                    reminders_sent.append(params.get("text"))
+                else:
+                    replied.setdefault(chat_id, time.monotonic())
+        elif method == "setWebhook":
+            webhooks_set.release()
+
+    api.on_call(on_call)
+    workdir = tempfile.mkdtemp(prefix="webhook-harness-")
+    db_path = os.path.join(workdir, "bot.db")
+    if args.reminders:
+        storage.init_db(db_path)
+        vid = storage.add_vehicle(db_path, REMINDER_CHAT_ID, "Prova", None, None, None, None, None)
+        due = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() + REMINDER_DELAY))
+        for i in range(args.reminders):
+            storage.add_time_reminder(db_path, vid, due, f"Promemoria {i}")
+        storage.close_all()
+    port = _free_port()
+    secret = secrets.token_urlsafe(24)
+    url = f"http://127.0.0.1:{port}/telegram"
+    env = {**os.environ, "BOT_TOKEN": "123:WEBHOOK", "BOT_API_URL": api.url, "TZ": "UTC",
+           "DB_PATH": db_path, "BOT_MODE": "webhook",
+           "WEBHOOK_LISTEN": "127.0.0.1", "WEBHOOK_PORT": str(port), "WEBHOOK_PATH": "telegram",
+           "WEBHOOK_URL": url, "WEBHOOK_SECRET": secret, "CONCURRENT_UPDATES": str(args.concurrent_updates),
+           "PYTHONPATH": str(ROOT) + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    if args.cluster:
+        env.update(WORKERS=str(args.cluster), WORKER_BASE_PORT=str(_free_port()))
+        cmd = [sys.executable, "-m", "app.cluster"]
+    else:
+        cmd = [sys.executable, "-m", "app.main"]
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        # un solo setWebhook: dal bot, o dal router del cluster quando tutti i worker ascoltano
+        if not webhooks_set.acquire(timeout=args.timeout):
+            raise TimeoutError("il bot non ha registrato il webhook entro il timeout")
+        # setWebhook parte prima che il server HTTP sia in ascolto: aspetta la porta
+        deadline = time.monotonic() + args.timeout
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"server webhook non raggiungibile:\n{proc.stderr.read() if proc.poll() is not None else ''}")
+                time.sleep(0.01)
+
+        bad_secret_status = post_update(url, "sbagliato", synthetic_update(1, FIRST_CHAT_ID - 1))
+
+        posted = {}
+        statuses = []
+
+        def send(i: int):
+            chat_id = FIRST_CHAT_ID + i
+            posted[chat_id] = time.monotonic()
+            statuses.append(post_update(url, secret, synthetic_update(i + 2, chat_id)))
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(send, range(args.updates)))
+        deadline = time.monotonic() + args.timeout
+        while len(replied) < args.updates and time.monotonic() < deadline:
+            time.sleep(0.01)
+        elapsed = time.monotonic() - started
+        # i promemoria scadono REMINDER_DELAY secondi dopo l'avvio: attende che arrivino
+        # tutti, poi ancora un po' per vedere eventuali doppioni
+        while len(reminders_sent) < args.reminders and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if args.reminders:
+            time.sleep(REMINDER_DELAY)
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.communicate(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+        api.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [replied[c] - t for c, t in posted.items() if c in replied]
+    return {
+        "updates": args.updates,
+        "accepted": statuses.count(200),
+        "replied": len(latencies),
+        "bad_secret_status": bad_secret_status,
+        "set_webhook_calls": len(api.calls_to("setWebhook")),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "latency_p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "latency_p95_ms": round(_percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        "latency_max_ms": round(max(latencies) * 1000, 1) if latencies else None,
+        **({"reminders": args.reminders, "reminders_sent": len(reminders_sent),
+            "reminders_duplicated": len(reminders_sent) - len(set(reminders_sent))} if args.reminders else {}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10, help="POST in parallelo verso il webhook")
+    parser.add_argument("--concurrent-updates", type=int, default=1, help="CONCURRENT_UPDATES del bot")
+    parser.add_argument("--cluster", type=int, default=0, help="avvia app.cluster con N worker invece di app.main")
+    parser.add_argument("--reminders", type=int, default=0, help="promemoria in scadenza poco dopo l'avvio")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()